@@ -1,57 +1,149 @@
-from config import Config
+import gc
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import nullcontext
+from config import Config, OPERAND_REG, OPERAND_BASE_REG
+from diagnostics import AssemblyError, Diagnostics, SourceError
+from expressions import Evaluator
+from symbols import Fixup, SymbolTable, fits
+from writer import (FORMATS, ImageWriter, NullImage, WordBuffer, merge_runs,
+                    open_image, words_from_bytes)
 
-DIRECTIVES = ["ORG", ".org", "DB", ".db"]
+ORGS = {"ORG", ".org"}
+# directives that emit words
+DATA = {"DB", ".db", ".dw", ".word", ".fill", ".space", ".incbin"}
+CONSTANTS = {".equ", ".set"}
+DIRECTIVES = (ORGS | DATA | CONSTANTS
+              | {".macro", ".endm", ".rept", ".endr", ".include", ".global"})
 
+intern = sys.intern
 
+# plain hex/binary/decimal numbers, anything else that starts like a number
+# goes through parse_int
+NUMBER = re.compile(r"0x[0-9a-fA-F]+|0b[01]+|[+-]?[0-9]+")
+
+# distinct words remembered by the tokenizer before its cache is reset
+WORD_CACHE_SIZE = 1 << 16
+
+# distinct instruction lines whose encoding is remembered, least recently
+# used first out
+ENCODE_CACHE_SIZE = 1 << 16
+
+# hits per miss the memo needs once it is full to be worth keeping
+ENCODE_CACHE_MIN_HITS = 3
+
+
+# tokens have no __dict__ and their values are interned, so the thousands of
+# "r2" or "ldi" in a large program all share one string
 class Token:
-    def __init__(self, t_type, value, line_num=None):
+    __slots__ = ("t_type", "value", "line_num", "col")
+
+    def __init__(self, t_type, value, line_num=None, col=None):
         self.t_type = t_type
         self.value = value
         self.line_num = line_num
+        self.col = col
 
     def __repr__(self):
         return f"Token({self.t_type}, {self.value}, {self.line_num})"
 
 
 class Tokenizer:
-    def __init__(self):
+    # mnemonics are the instruction names (Config.instr_map works), every
+    # mnemonic token then shares the config's string
+    def __init__(self, mnemonics=()):
         self.tokens = []
         self.comments = []
+        self.mnemonics = {name: name for name in mnemonics}
+        self.lines = 0  # lines read so far
+        # word -> (type, value), the type of a word never depends on where it
+        # is so each distinct word is only classified once
+        self.words = {}
 
     def parse_tokens(self, file_name=None, text=""):
+        # nothing built here can form a cycle, without this the garbage
+        # collector keeps rescanning every token kept so far
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for instruction in self.iter_tokens(file_name, text,
+                                                self.comments):
+                self.tokens.append(instruction)
+        finally:
+            if enabled:
+                gc.enable()
+        return self.tokens, self.comments
+
+    # lazily yields the tokens of every non empty line, the file is read one
+    # line at a time so memory does not grow with the size of the source.
+    # max_tokens stops tokenizing a line early (used by the layout pass)
+    def iter_tokens(self, file_name=None, text="", comments=None,
+                    max_tokens=None, first_line=0):
         if file_name is not None:
-            f = open(file_name, "r", encoding="utf-8")
-            instructions = f.readlines()
-            f.close()
+            with open(file_name, "r", encoding="utf-8") as f:
+                yield from self.tokenize_lines(f, comments, max_tokens,
+                                               first_line)
         else:
-            instructions = text
+            if isinstance(text, str):
+                text = text.splitlines()
+            yield from self.tokenize_lines(text, comments, max_tokens,
+                                           first_line)
 
+    def tokenize_lines(self, lines, comments=None, max_tokens=None,
+                       first_line=0):
+        words = self.words
         # prepare instructions
-        for i, line in enumerate(instructions):
-            pline = line.strip(",").split(";", 1)
-            if len(pline) > 1:
-                comment = (pline[1].strip("\n"), i)
-                self.comments.append(comment)
+        for i, line in enumerate(lines, first_line):
+            pline = line.strip(",")
+            code, semicolon, comment = pline.partition(";")
+            if semicolon and comments is not None:
+                comments.append((comment.strip("\n"), i))
 
-            unparsed_tokens = pline[0].split()
+            unparsed_tokens = code.split(None, max_tokens or -1)
+            if max_tokens is not None:
+                unparsed_tokens = unparsed_tokens[:max_tokens]
             instruction = []
+            col = len(line) - len(line.lstrip(","))
             for word in unparsed_tokens:
-                t_type = "name"
-                value = word.strip(",")
-                line_num = i
-                if word in DIRECTIVES:
-                    t_type = "directive"
-                elif (num := parse_int(word)) is not None:
-                    t_type = "immediate"
-                elif "(" in word and ")" in word:
-                    t_type = "reg"
-                elif ":" in word:
-                    t_type = "tag"
-                    value = value.strip(':')
-                instruction.append(Token(t_type, value, line_num))
+                col = line.find(word, col)
+                kind = words.get(word)
+                if kind is None:
+                    if len(words) >= WORD_CACHE_SIZE:
+                        words.clear()
+                    kind = words[word] = self.classify(word)
+                instruction.append(Token(kind[0], kind[1], i, col))
+                col += len(word)
+            self.lines = i + 1
             if instruction:
-                self.tokens.append(instruction)
-        return self.tokens, self.comments
+                yield tuple(instruction)
+
+    # (type, value) of a word, through the cache
+    def kind(self, word):
+        kind = self.words.get(word)
+        if kind is None:
+            if len(self.words) >= WORD_CACHE_SIZE:
+                self.words.clear()
+            kind = self.words[word] = self.classify(word)
+        return kind
+
+    def classify(self, word):
+        value = word.strip(",")
+        if word in DIRECTIVES:
+            return "directive", intern(value)
+        elif NUMBER.fullmatch(word):
+            return "immediate", intern(value)
+        elif ((word[0].isdigit() or word[0] in "+-")
+              and parse_int(word) is not None):
+            return "immediate", intern(value)
+        elif "(" in word and ")" in word:
+            return "reg", intern(value)
+        elif ":" in word:
+            return "tag", intern(value.strip(':'))
+        return "name", self.mnemonics.get(value) or intern(value)
 
 
 def parse_int(num_str):
@@ -80,6 +172,16 @@ def pint(num_str):
     return int(num_str, 10)
 
 
+# "offset(r3)" -> ("offset", "r3"), the offset can be an expression with
+# parentheses of its own. (arg, None) without a base register
+def split_base(arg):
+    if arg[-1:] == ")":
+        head, _, reg = arg[:-1].rpartition(chr(40))
+        if reg[1:].isdigit() and reg[:1] in "rR":
+            return head or "0", reg
+    return arg, None
+
+
 def parse_base(arg):
     if chr(40) not in arg:
         return pint(arg), "r0"
@@ -90,126 +192,726 @@ def parse_base(arg):
 class Assembler:
     config: Config
     mode: str  # can be binary, binnum, hex
+    byteorder: str  # big or little, only used in binary mode
+    backend: str  # python, or numpy to encode whole files in bulk
     orgs: list
-    tags: dict
+    symbols: SymbolTable
+    tags: dict  # label -> address, same dict as symbols.symbols
+    expressions: Evaluator  # immediates that are not a number or a label
+    diagnostics: Diagnostics  # errors of the file being assembled
+    file_name: str  # the file being assembled, for diagnostics
+    preprocessor: object  # macros.Preprocessor of the file, knows includes
     verbose: bool
+    word_bytes: int  # bytes in a word, for .db and .incbin
+    word_mask: int
+    stats: object  # stats.Stats to record timings and counts into, or None
+    listing: object  # listing.Listing to record where words come from
+    memo: OrderedDict  # token values -> (word, label operands, relative)
+    memoize: bool  # off once the memo is full and mostly missing
+    memo_hits: int
+    memo_misses: int
 
-    def __init__(self, config, mode="binary", verbose=False):
+    def __init__(self, config, mode="binary", verbose=False, byteorder="big",
+                 backend="python", stats=None):
         self.config = config
         self.orgs = []
-        self.tags = {}
+        self.symbols = SymbolTable()
+        self.tags = self.symbols.symbols
+        self.expressions = Evaluator(self.tags)
+        self.diagnostics = Diagnostics()
+        self.file_name = None
+        self.preprocessor = None
         self.mode = mode
+        self.byteorder = byteorder
+        self.backend = backend
         self.verbose = verbose
+        self.word_bytes = config.word_size // 8
+        self.word_mask = (1 << config.word_size) - 1
+        self.stats = stats
+        self.listing = None
+        self.memo = OrderedDict()
+        self.memoize = True
+        self.memo_hits = 0
+        self.memo_misses = 0
 
     def convert_single(self, instr):
-        instructions, comments = Tokenizer().parse_tokens(text=instr)
-        num = self.get_instr_bin(instructions[0])
+        num = self.encode_line(instr)
+        bits = self.config.word_size
         if self.mode == "binnum":
-            print("{:<20} : ".format(instr[: len(instr)]), f"{num:#0{34}b}")
+            print("{:<20} : ".format(instr[: len(instr)]),
+                  f"{num:#0{bits + 2}b}")
         elif self.mode == "hex":
-            print("{:<20} : ".format(instr[: len(instr)]), f"{num:#0{10}x}")
+            print("{:<20} : ".format(instr[: len(instr)]),
+                  f"{num:#0{bits // 4 + 2}x}")
         else:
-            print("{:<20} : ".format(instr[: len(instr)]), f"{num:#0{10}x}")
-
-    def get_instr_bin(self, instruction):
-        instr_num = 0
-        opcode, format, textformat = self.config.instr_map[instruction[0].value]
-        tf_fields = self.config.textformats[textformat].fields
-        for field in self.config.formats[format].fields:
-            mask = ((1 << (field.msb + 1)) - (1 << field.lsb)) >> field.lsb
-            # gets the index of the binary field in the text instruction field
-            index = None
-            for i in range(len(self.config.textformats[textformat].fields)):
-                textfield = self.config.textformats[textformat].fields[i]
-                if field.name in textfield:
-                    index = i
-
-            # no index found, just go next or do branch condition
-            if index is None:
-                if "condition" == field.name:
-                    instr_num |= (
-                        self.config.cond_map[instruction[0].value] & mask
-                    ) << field.lsb
-                continue
+            print("{:<20} : ".format(instr[: len(instr)]),
+                  f"{num:#0{bits // 4 + 2}x}")
+
+    def encode_line(self, instr):
+        for instruction in Tokenizer(self.config.instr_map).iter_tokens(
+                text=[instr]):
+            return self.get_instr_bin(instruction)
+        raise ValueError("no instruction to encode")
 
-            token = instruction[index].value.lower()
-            if "op" in field.name:
-                instr_num |= (opcode & mask) << field.lsb
-            elif "R" in field.name and "imm" not in tf_fields[index]:
-                reg = token
-                instr_num |= (int(reg.replace("r", "")) & mask) << field.lsb
-            elif "R" in field.name and "imm" in tf_fields[index]:
-                reg = parse_base(token)[1]
-                instr_num |= (int(reg.replace("r", "")) & mask) << field.lsb
-            elif "imm" in field.name:
-                if (res := self.tags.get(token)) is not None:
-                    imm = res - instruction[0].line_num
-                else:
-                    imm = parse_base(token)[0] if chr(40) in token else pint(token)
-                instr_num |= (imm & mask) << field.lsb
+    # lines are remembered by their token values, generated and unrolled
+    # programs repeat the same few lines over and over. a line with labels
+    # is remembered without them and they are filled in for each address
+    def get_instr_bin(self, instruction, address=0, fixups=None):
+        if not self.memoize:
+            return self.encode_instruction(instruction, address, fixups, [])
+        key = tuple([token.value for token in instruction])
+        if (entry := self.memo.get(key)) is not None:
+            word = entry[0] if not entry[1] else self.recall(entry, address)
+            if word is not None:
+                self.memo.move_to_end(key)
+                self.memo_hits += 1
+                return word
+        self.memo_misses += 1
+
+        labels = []
+        pending = len(fixups) if fixups is not None else 0
+        word = self.encode_instruction(instruction, address, fixups, labels)
+        # a line waiting for a label is encoded again once it is known
+        if fixups is not None and len(fixups) != pending:
+            return word
+        if len(self.memo) >= ENCODE_CACHE_SIZE:
+            # lines that rarely repeat cost more to remember than to encode
+            if self.memo_hits < ENCODE_CACHE_MIN_HITS * self.memo_misses:
+                self.memoize = False
+                self.memo.clear()
+                return word
+            self.memo.popitem(last=False)
+        if not labels:
+            self.memo[key] = (word, (), False)
+            return word
+        fixed = word
+        for _, _, shift, mask in labels:
+            fixed &= ~(mask << shift)
+        relative = self.config.encoders[key[0]].relative
+        self.memo[key] = (fixed, tuple(labels), relative)
+        return word
+
+    # a remembered line, with the fields of its label operands filled in for
+    # this address. None when a label is missing or does not fit here, the
+    # line is then encoded again for the error
+    def recall(self, entry, address):
+        word, labels, relative = entry
+        for token, expression, shift, mask in labels:
+            if not expression:
+                value = self.tags.get(token)
+            else:
+                value = self.expressions.evaluate(
+                    self.expressions.parse(token))
+            if value is None:
+                return None
+            if relative:
+                value -= address + 1
+            if not fits(value, mask, relative):
+                return None
+            word |= (value & mask) << shift
+        return word
+
+    # references to undefined labels are added to fixups as
+    # (label, shift, mask, relative, expression or None for a bare label,
+    # index of the operand) and left as zero in the word, without fixups
+    # they are an error. operands with labels are relative to the next
+    # instruction for instructions with a condition field (branches)
+    # operands are checked against their fields: registers must exist and
+    # immediates must fit as a signed or an unsigned number (signed for
+    # branches). errors are raised as SourceError at the token
+    # operands that come from labels are added to labels as (text, whether
+    # it is an expression, shift, mask). only strings and numbers are kept so
+    # the garbage collector can leave the remembered lines alone
+    def encode_instruction(self, instruction, address, fixups, labels):
+        encoder = self.config.encoders.get(instruction[0].value)
+        if encoder is None:
+            raise SourceError(f"unknown instruction {instruction[0].value}",
+                              instruction[0])
+        if len(instruction) != encoder.operands + 1:
+            raise SourceError(f"{instruction[0].value} takes "
+                              f"{encoder.operands} operand(s), got "
+                              f"{len(instruction) - 1}", instruction[0])
+        instr_num = encoder.fixed
+        for index, kind, shift, mask in encoder.slots:
+            token = instruction[index].value
+            if kind == OPERAND_REG:
+                try:
+                    value = int(token.lower().replace("r", ""))
+                except ValueError:
+                    raise SourceError(f"invalid register {token}",
+                                      instruction[index]) from None
+                if value > mask or value < 0:
+                    raise SourceError(f"register {token} out of range "
+                                      f"(r0-r{mask})", instruction[index])
+            elif kind == OPERAND_BASE_REG:
+                token = split_base(token)[1]
+                value = int(token[1:]) if token is not None else 0
+                if value > mask:
+                    raise SourceError(f"register {token} out of range "
+                                      f"(r0-r{mask})", instruction[index])
             else:
-                raise ValueError("invalid field in config")
+                if token[-1] == ")":
+                    token = split_base(token)[0]
+                if (target := self.tags.get(token)) is not None:
+                    value = target
+                    if encoder.relative:
+                        value = target - (address + 1)
+                    labels.append((token, False, shift, mask))
+                elif (value := parse_int(token.lower())) is None:
+                    try:
+                        expression = self.expressions.parse(token)
+                    except ValueError as exc:
+                        raise SourceError(str(exc),
+                                          instruction[index]) from None
+                    if (value := self.expressions.evaluate(expression)) is None:
+                        if fixups is None:
+                            raise SourceError("undefined symbol " + (
+                                self.expressions.missing(expression)),
+                                instruction[index])
+                        name = self.expressions.missing(expression)
+                        fixups.append((name, shift, mask, encoder.relative,
+                                       None if name == token else expression,
+                                       index))
+                        continue
+                    if type(expression) is not int:
+                        labels.append((token, True, shift, mask))
+                        if encoder.relative:
+                            value -= address + 1
+                if (value > (mask >> 1 if encoder.relative else mask)
+                        or value < ~(mask >> 1)):
+                    raise SourceError(f"{token} ({value}) does not fit in "
+                                      f"{mask.bit_length()} bits",
+                                      instruction[index])
+            instr_num |= (value & mask) << shift
         return instr_num
 
+    # macros, repeats and includes are expanded lazily between the tokenizer
+    # and the assembler
+    def preprocess(self, tokenizer, instructions, file_name=None):
+        from macros import Preprocessor
+        self.preprocessor = Preprocessor(tokenizer, self.value)
+        self.preprocessor.file = file_name
+        return self.preprocessor.expand(instructions, file_name)
+
+    def phase(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.phase(name)
+
     def convert_text_file(self, file_in, file_out):
-        instructions, comments = Tokenizer().parse_tokens(file_in)
+        self.file_name = file_in
+        with self.phase("tokenize"):
+            tokenizer = Tokenizer(self.config.instr_map)
+            instructions, comments = tokenizer.parse_tokens(file_in)
+        if self.stats is not None:
+            self.stats.count("lines", tokenizer.lines)
+            self.stats.count("tokens", sum(map(len, instructions)))
+        instructions = self.preprocess(tokenizer, instructions, file_in)
+
+        if (self.backend == "numpy" and not self.verbose
+                and self.listing is None):
+            import npbackend
+            # falls back to the python encoder without numpy
+            if npbackend.available():
+                # stops at the first error
+                try:
+                    with self.phase("layout"):
+                        asm_instructions = list(self.layout(instructions))
+                    with self.phase("encode"):
+                        addresses, words = npbackend.encode(self,
+                                                            asm_instructions)
+                except AssemblyError:
+                    raise
+                except ValueError as exc:
+                    self.report(exc, None)
+                    self.diagnostics.check()
+                if self.stats is not None:
+                    self.stats.count("instructions", len(asm_instructions))
+                    self.stats.count("tags", len(self.tags))
+                if file_out and self.mode in FORMATS:
+                    # data words come after every instruction, records are
+                    # written in address order like the default path
+                    order = addresses.argsort(kind="stable")
+                    self.write_lines(zip(addresses[order].tolist(),
+                                         words[order].tolist()), file_out)
+                elif file_out:
+                    with self.phase("write"):
+                        npbackend.write_image(addresses, words, file_out,
+                                              self.mode, self.byteorder,
+                                              self.config.word_size)
+                return
+
+        words = WordBuffer()
+        with self.phase("assemble"):
+            self.assemble(instructions, words)
+        if file_out:
+            self.write_runs(words.runs(), file_out)
+        if self.listing is not None:
+            with self.phase("listing"):
+                self.listing.save(words.words, self.tags,
+                                  {(file_in, line): text
+                                   for text, line in comments},
+                                  self.config.word_size)
+
+    # single pass assembly straight into the output file, forward
+    # references are patched in the file once their label is found so the
+    # program is never held in memory
+    def convert_text_stream(self, file_in, file_out):
+        # record formats can not be patched, forward references need every
+        # word to be kept until the end
+        if self.mode in FORMATS:
+            return self.convert_text_file(file_in, file_out)
+        self.file_name = file_in
+        tokenizer = Tokenizer(self.config.instr_map)
+        instructions = self.preprocess(tokenizer,
+                                       tokenizer.iter_tokens(file_in), file_in)
+        with self.phase("assemble"):
+            if file_out:
+                with ImageWriter(file_out, self.mode, self.byteorder,
+                                 word_size=self.config.word_size) as fout:
+                    self.assemble(instructions, fout)
+                if self.stats is not None:
+                    self.stats.count("padding", fout.padding)
+            else:
+                self.assemble(instructions, NullImage())
+        # the words are not kept, only the source map can be written
+        if self.listing is not None:
+            with self.phase("listing"):
+                self.listing.save(None, self.tags, {}, self.config.word_size)
+        if self.stats is not None:
+            self.stats.count("lines", tokenizer.lines)
+
+    # assembles in one pass into out, anything with write(address, word)
+    # returning a handle and patch(handle, bits). errors are collected as
+    # diagnostics and raised together as an AssemblyError at the end, a bad
+    # instruction still takes its word so the addresses after it are right
+    def assemble(self, instructions, out):
+        symbols = self.symbols
+        listing = self.listing
         address = 0
+        count = 0
+        fixups = 0
+        # like the tokenizer, nothing here forms a cycle and the remembered
+        # lines would otherwise make the collector rescan every token
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for instruction in instructions:
+                try:
+                    if instruction[0].t_type == "tag":
+                        self.define(instruction[0].value, address, out)
+                        # a label can be followed by an instruction on the
+                        # same line
+                        instruction = instruction[1:]
+                        if not instruction:
+                            continue
+
+                    match instruction[0].t_type:
+                        case "directive" if instruction[0].value in ORGS:
+                            address = self.org(instruction)
+                        case "directive" if instruction[0].value in CONSTANTS:
+                            self.constant(instruction)
+                        case "directive":
+                            start = address
+                            address = self.emit(instruction, address, out)
+                            if listing is not None and address != start:
+                                listing.add(start, address - start,
+                                            *self.where(instruction[0])[:2],
+                                            instruction)
+                        case "name":
+                            refs = []
+                            try:
+                                instr_num = self.get_instr_bin(
+                                    instruction, address, refs)
+                            except ValueError as exc:
+                                self.report(exc, instruction)
+                                instr_num = 0
+                                refs = []
+                            handle = out.write(address, instr_num)
+                            if listing is not None:
+                                listing.add(address, 1,
+                                            *self.where(instruction[0])[:2],
+                                            instruction)
+                            for (name, shift, mask, relative, expression,
+                                 index) in refs:
+                                source = self.where(instruction[index])
+                                symbols.reference(name, Fixup(
+                                    handle, address, shift, mask, relative,
+                                    expression, source))
+                                fixups += 1
+                            if self.verbose:
+                                self.print_instruction(address, instruction,
+                                                       instr_num)
+                            address = address + 1
+                            count += 1
+                except AssemblyError:
+                    raise
+                except (ValueError, OSError) as exc:
+                    self.report(exc, instruction)
+        except AssemblyError:
+            raise
+        except (ValueError, OSError) as exc:
+            # from the preprocessor, which cannot go on after an error
+            self.report(exc, None)
+        finally:
+            if enabled:
+                gc.enable()
+
+        if self.stats is not None:
+            self.stats.count("instructions", count)
+            self.stats.count("tags", len(symbols.symbols))
+            self.stats.count("fixups", fixups)
+            self.count_memo()
+        for name in symbols.unresolved():
+            for fixup in symbols.pending[name]:
+                self.diagnostics.error(*fixup.source or (None, None, None),
+                                       f"undefined symbol {name}")
+        self.diagnostics.check()
+
+    # file, line and column of a token
+    def where(self, token):
+        file_name = self.file_name
+        if self.preprocessor is not None:
+            file_name = self.preprocessor.file
+        if token is None:
+            return file_name, None, None
+        return file_name, token.line_num, token.col
+
+    def report(self, exc, instruction):
+        token = getattr(exc, "token", None)
+        if token is None and instruction:
+            token = instruction[0]
+        file_name, line, col = self.where(token)
+        if getattr(exc, "file", None) is not None:
+            file_name = exc.file
+        self.diagnostics.error(file_name, line, col, str(exc))
 
-        asm_instructions = []
+    def define(self, name, address, out):
+        if name in self.expressions.constants:
+            raise ValueError(f"label {name} is already a constant")
+        for fixup in self.symbols.define(name, address):
+            target = address
+            if fixup.expression is not None:
+                target = self.expressions.evaluate(fixup.expression)
+                if target is None:
+                    # waits for the next label of the expression
+                    self.symbols.reference(
+                        self.expressions.missing(fixup.expression), fixup)
+                    continue
+            if not fits(fixup.value(target), fixup.mask, fixup.relative):
+                self.diagnostics.error(
+                    *fixup.source or (None, None, None),
+                    f"{name} ({fixup.value(target)}) does not fit in "
+                    f"{fixup.mask.bit_length()} bits")
+                continue
+            bits = fixup.bits(target)
+            out.patch(fixup.handle, bits)
+            if self.verbose:
+                print(f"{fixup.address:#0{4}x}: patched {name} : {bits:#0{10}x}")
+
+    # writes the words of a data directive to out in one go
+    def emit(self, instruction, address, out):
+        refs = []
+        words = self.data(instruction, address, refs)
+        handle = out.write_words(address, words)
+        for offset, name, expression in refs:
+            self.symbols.reference(name, Fixup(
+                handle + offset, address + offset, 0, self.word_mask, False,
+                expression, self.where(instruction[offset + 1])))
+        if self.stats is not None:
+            self.stats.count("data words", len(words))
+            self.stats.count("fixups", len(refs))
+        if self.verbose:
+            print(f"{address:#0{4}x}: {instruction[0].value} "
+                  f"{len(words)} words")
+        return address + len(words)
+
+    # words of a data directive. labels in .word that are not defined yet
+    # are added to refs as (offset, label, expression or None) and left as
+    # zero, without refs they are an error
+    def data(self, instruction, address=0, refs=None):
+        name = instruction[0].value
+        mask = self.word_mask
+        if name in (".dw", ".word"):
+            words = array("I")
+            for i, token in enumerate(instruction[1:]):
+                if (value := self.token_value(token)) is None:
+                    expression = self.expressions.parse(token.value)
+                    label = self.expressions.missing(expression)
+                    if refs is None:
+                        raise SourceError(f"undefined symbol {label}", token)
+                    refs.append((i, label, None if label == token.value
+                                 else expression))
+                    value = 0
+                words.append(self.fitting(value, mask, token))
+            return words
+        elif name in ("DB", ".db"):
+            data = bytes(self.fitting(self.number(instruction, i), 0xff,
+                                      instruction[i])
+                         for i in range(1, len(instruction)))
+            return words_from_bytes(data, self.word_bytes)
+        elif name == ".fill":
+            value = 0
+            if len(instruction) > 2:
+                value = self.fitting(self.number(instruction, 2), mask,
+                                     instruction[2])
+            return array("I", [value]) * self.count(instruction)
+        elif name == ".space":
+            return array("I", bytes(4 * self.count(instruction)))
+        elif name == ".incbin":
+            try:
+                with open(self.path(instruction), "rb") as f:
+                    return words_from_bytes(f.read(), self.word_bytes)
+            except OSError as exc:
+                raise SourceError(f"can not read {self.path(instruction)}: "
+                                  f"{exc.strerror}", instruction[1]) from None
+        raise ValueError(f"unknown directive {name}")
+
+    # words a data directive takes without building them, for layout passes
+    def data_size(self, instruction):
+        name = instruction[0].value
+        if name in (".dw", ".word"):
+            return len(instruction) - 1
+        elif name in ("DB", ".db"):
+            return -(-(len(instruction) - 1) // self.word_bytes)
+        elif name in (".fill", ".space"):
+            return self.count(instruction)
+        elif name == ".incbin":
+            try:
+                size = os.path.getsize(self.path(instruction))
+            except OSError as exc:
+                raise SourceError(f"can not read {self.path(instruction)}: "
+                                  f"{exc.strerror}", instruction[1]) from None
+            return -(-size // self.word_bytes)
+        raise ValueError(f"unknown directive {name}")
+
+    # value of a number, label or expression, None while it references a
+    # label that is not defined yet
+    def value(self, text):
+        if (value := self.tags.get(text)) is not None:
+            return value
+        if (value := parse_int(text.lower())) is not None:
+            return value
+        return self.expressions.evaluate(self.expressions.parse(text))
+
+    # a data value is masked to its word or byte, signed or unsigned, and
+    # is an error when it does not fit like an operand
+    @staticmethod
+    def fitting(value, mask, token):
+        if not fits(value, mask):
+            raise SourceError(f"{token.value} ({value}) does not fit in "
+                              f"{mask.bit_length()} bits", token)
+        return value & mask
+
+    # value of an operand token, expression errors are raised at the token
+    def token_value(self, token):
+        try:
+            return self.value(token.value)
+        except SourceError:
+            raise
+        except ValueError as exc:
+            raise SourceError(str(exc), token) from None
+
+    def number(self, instruction, index):
+        value = None
+        if index < len(instruction):
+            value = self.token_value(instruction[index])
+        if value is None:
+            raise SourceError(f"invalid {instruction[0].value} value",
+                              instruction[0])
+        return value
+
+    def count(self, instruction):
+        count = self.number(instruction, 1)
+        if count < 0:
+            raise SourceError(f"negative {instruction[0].value} count",
+                              instruction[0])
+        return count
+
+    def path(self, instruction):
+        if len(instruction) < 2:
+            raise SourceError(".incbin without a file", instruction[0])
+        return instruction[1].value.strip("\"'")
+
+    # .equ name, value and .set name, value. passes that lay the program out
+    # before encoding it only see the last value of a constant, so they
+    # cannot change one
+    def constant(self, instruction, layout=False):
+        if len(instruction) != 3:
+            raise SourceError(f"{instruction[0].value} needs a name and a "
+                              f"value", instruction[0])
+        name = instruction[1].value
+        redefine = instruction[0].value == ".set"
+        if layout and name in self.expressions.constants:
+            if (self.expressions.evaluate(self.expressions.parse(
+                    instruction[2].value)) != self.expressions.constants[name]):
+                raise ValueError(f"constant {name} changes value, only the "
+                                 f"single pass assembler can do that")
+        previous = self.expressions.constants.get(name)
+        value = self.expressions.define(name, instruction[2].value, redefine)
+        # remembered lines were encoded with the old value
+        if previous is not None and previous != value:
+            self.memo.clear()
+
+    def org(self, instruction):
+        if len(instruction) < 2:
+            raise SourceError(f"{instruction[0].value} without an address",
+                              instruction[0])
+        org = self.token_value(instruction[1])
+        if self.verbose:
+            print(instruction[1])
+        if org is None:
+            raise SourceError("Invalid org value", instruction[1])
+        return org
+
+    # assigns an address to every instruction and records the tags, for
+    # encoders that need every label before they start
+    def layout(self, instructions):
+        address = 0
         for instruction in instructions:
+            if instruction[0].t_type == "tag":
+                self.symbols.define(instruction[0].value, address)
+                instruction = instruction[1:]
+                if not instruction:
+                    continue
+
             match instruction[0].t_type:
+                case "directive" if instruction[0].value in ORGS:
+                    address = self.org(instruction)
+                case "directive" if instruction[0].value in CONSTANTS:
+                    self.constant(instruction, layout=True)
                 case "directive":
-                    org = parse_int(instruction[1].value)
-                    address = org
-                    print(instruction[1])
-                    if org is None:
-                        raise ValueError("Invalid org value")
+                    yield address, instruction
+                    address += self.data_size(instruction)
                 case "name":
-                    asm_instructions.append((address, instruction))
+                    yield address, instruction
                     address = address + 1
-                case "tag":
-                    self.tags[instruction[0].value] = address + 1
 
-        instructions_binary = []
+    # encodes (address, instruction) pairs into (address, word) pairs, all
+    # labels must already be known
+    def encode(self, asm_instructions):
         for addr, instruction in asm_instructions:
-            instr_num = self.get_instr_bin(instruction)
-            instructions_binary.append(instr_num)
-            instr_str = ""
-            for instr in instruction:
-                instr_str += instr.value + ' '
+            if instruction[0].t_type == "directive":
+                yield from enumerate(self.data(instruction, addr), addr)
+                continue
+            instr_num = self.get_instr_bin(instruction, addr)
             if self.verbose:
-                  print(f"{addr:#0{4}x}:", ': {:<30} : '
-                      .format(instr_str),
-                      f"{instr_num:#0{10}x}")
+                self.print_instruction(addr, instruction, instr_num)
+            yield addr, instr_num
+        if self.stats is not None:
+            self.count_memo()
 
-        if file_out:
-            self.write_lines(instructions_binary, file_out)
+    def count_memo(self):
+        self.stats.count("memo hits", self.memo_hits)
+        self.stats.count("memo misses", self.memo_misses)
+        self.memo_hits = self.memo_misses = 0
+
+    def print_instruction(self, addr, instruction, instr_num):
+        instr_str = " ".join(instr.value for instr in instruction)
+        print(f"{addr:#0{4}x}:", ': {:<30} : '
+              .format(instr_str),
+              f"{instr_num:#0{10}x}")
 
     def write_lines(self, lines, filename):
-        if self.mode == "binary":
-            fout = open(filename, "wb")
-            i = 0
-            for line in lines:
-                while i < line[0]:
-                    fout.write(b"\x00\x00\x00\x00")
-                    i = i + 1
-                fout.write(line[1].to_bytes(4, signed=False))
-                i = i + 1
-            fout.close()
-        else:
-            fout = open(filename, "w", encoding="utf-8")
-            i = 0
-            for line in lines:
-                while i < line[0]:
-                    if self.mode == "binnum":
-                        fout.write(f"{0:0{32}b}\n")
-                    elif self.mode == "hex":
-                        fout.write(f"{00000000:0{8}x}\n")
-                    i = i + 1
-
-                if self.mode == "binnum":
-                    fout.write(f"{line[1]:0{32}b}\n")
-                elif self.mode == "hex":
-                    fout.write(f"{line[1]:0{8}x}\n")
-                i = i + 1
-            fout.close()
+        with self.phase("write"):
+            if getattr(FORMATS.get(self.mode), "ordered", False):
+                # a word written twice keeps the later one
+                lines = sorted(dict(lines).items())
+            with self.open_image(filename) as fout:
+                for address, word in lines:
+                    fout.write(address, word)
+        if self.stats is not None:
+            self.stats.count("padding", fout.padding)
+
+    # writes (address, words) runs
+    def write_runs(self, runs, filename):
+        with self.phase("write"):
+            if getattr(FORMATS.get(self.mode), "ordered", False):
+                runs = merge_runs(runs)
+            with self.open_image(filename) as fout:
+                for address, words in runs:
+                    fout.write_words(address, words)
+        if self.stats is not None:
+            self.stats.count("padding", fout.padding)
+
+    def open_image(self, filename):
+        return open_image(filename, self.mode, self.byteorder,
+                          self.config.word_size)
+
+
+# an assembled program in memory. words holds every word in address order
+# without the gaps between ORG regions, starts says where each run of
+# consecutive addresses begins in it
+class Image:
+    words: array
+    starts: list  # (address, index of its first word) of every run
+    symbols: dict  # label -> address
+    constants: dict  # .equ/.set name -> value
+    word_size: int
+
+    def __init__(self, buffer, symbols, constants, word_size):
+        self.words = buffer.words
+        self.starts = buffer.starts
+        # the buffer keeps the runs in source order, an ORG that goes back
+        # puts them out of address order or over earlier words, which the
+        # later words replace like in an image file
+        if any(a + j - i > b for (a, i), (b, j)
+               in zip(self.starts, self.starts[1:])):
+            self.words = array("I")
+            self.starts = []
+            for address, words in merge_runs(buffer.runs()):
+                self.starts.append((address, len(self.words)))
+                self.words.extend(words)
+        self.symbols = symbols
+        self.constants = constants
+        self.word_size = word_size
+
+    def __len__(self):
+        return len(self.words)
+
+    # the words in address order, without the gaps
+    def __iter__(self):
+        return iter(self.words)
+
+    # the word at an address, gaps between regions read as zero
+    def __getitem__(self, address):
+        run = bisect_right(self.starts, (address, len(self.words))) - 1
+        if run >= 0:
+            start, index = self.starts[run]
+            end = (self.starts[run + 1][1] if run + 1 < len(self.starts)
+                   else len(self.words))
+            if address - start < end - index:
+                return self.words[index + address - start]
+        if address < 0:
+            raise IndexError(f"negative address {address}")
+        return 0
+
+    # (address, memoryview of the words) of every run, without copies
+    def runs(self):
+        view = memoryview(self.words)
+        ends = [index for _, index in self.starts[1:]] + [len(self.words)]
+        for (address, start), end in zip(self.starts, ends):
+            yield address, view[start:end]
+
+
+# assembles source text (a string or lines) in memory, without printing or
+# writing anything. errors are raised as one AssemblyError. file_name is
+# only used for diagnostics and to find .include/.incbin files
+def assemble(source, config=None, file_name=None):
+    if config is None:
+        config = Config()
+    assembler = Assembler(config)
+    assembler.file_name = file_name
+    tokenizer = Tokenizer(config.instr_map)
+    instructions = assembler.preprocess(
+        tokenizer, tokenizer.iter_tokens(text=source), file_name)
+    buffer = WordBuffer()
+    assembler.assemble(instructions, buffer)
+    return Image(buffer, dict(assembler.tags),
+                 dict(assembler.expressions.constants), config.word_size)
+
+
+# the word of one instruction, labels are not allowed
+def encode(line, config=None):
+    return Assembler(config if config is not None else Config()).encode_line(
+        line)
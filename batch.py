@@ -0,0 +1,81 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from assembler import Assembler
+from writer import FORMATS
+
+EXTENSIONS = {"binary": ".bin", "hex": ".hex", "binnum": ".binnum",
+              **{mode: writer.extension for mode, writer in FORMATS.items()}}
+
+# per worker process state, set up once by init_worker
+worker = {}
+
+
+# expands globs and @manifest files (one path or glob per line)
+def expand_sources(patterns):
+    files = []
+    for pattern in patterns:
+        if pattern.startswith("@"):
+            with open(pattern[1:], "r", encoding="utf-8") as f:
+                lines = [line.strip() for line in f]
+            files.extend(expand_sources(
+                [line for line in lines if line and not line.startswith("#")]))
+        elif glob.has_magic(pattern):
+            files.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            files.append(pattern)
+    return files
+
+
+def output_name(file_in, mode):
+    return os.path.splitext(file_in)[0] + EXTENSIONS[mode]
+
+
+def init_worker(config, mode, byteorder, stream):
+    worker["config"] = config
+    worker["mode"] = mode
+    worker["byteorder"] = byteorder
+    worker["stream"] = stream
+
+
+# assembles one file, errors are returned so they do not stop the batch
+def assemble_one(file_in):
+    mode = worker["mode"]
+    assembler = Assembler(worker["config"], mode, byteorder=worker["byteorder"])
+    try:
+        if worker["stream"]:
+            assembler.convert_text_stream(file_in, output_name(file_in, mode))
+        else:
+            assembler.convert_text_file(file_in, output_name(file_in, mode))
+    except Exception as exc:
+        return file_in, f"{type(exc).__name__}: {exc}"
+    return file_in, None
+
+
+# assembles every file next to its input, the config is only built once and
+# handed to the workers. returns the list of (file, error) that failed
+def assemble_batch(files, config, mode="binary", byteorder="big",
+                   stream=False, jobs=None):
+    initargs = (config, mode, byteorder, stream)
+    if jobs == 1:
+        init_worker(*initargs)
+        results = map(assemble_one, files)
+        return report(results)
+
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (4 * jobs))
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=initargs) as pool:
+        results = pool.map(assemble_one, files, chunksize=chunksize)
+        return report(results)
+
+
+def report(results):
+    failures = []
+    for file_in, error in results:
+        if error is None:
+            print(f"ok     {file_in}")
+        else:
+            print(f"FAILED {file_in}: {error}")
+            failures.append((file_in, error))
+    return failures
@@ -0,0 +1,272 @@
+import argparse
+import bisect
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from config import Config, VERSION, OPERAND_BASE_REG, OPERAND_IMM
+from assembler import Assembler, Tokenizer
+from writer import WordBuffer
+
+# tokenize, assemble and write are the default single pass path, layout and
+# encode the two pass path of --numpy and -i
+PHASES = ("tokenize", "assemble", "write", "layout", "encode")
+DEFAULT_PHASES = ("tokenize", "assemble", "write")
+
+
+# writes a random program of about size instructions using every instruction
+# of the config, with labels every label_every lines and an ORG gap every
+# org_every lines. branches use nearby labels and immediates sometimes use
+# a label whose address fits, so every operand is in range
+def generate_program(config, size, fout, seed=0, label_every=64,
+                     org_every=4096, org_gap=256):
+    rng = random.Random(seed)
+    names = sorted(config.instr_map)
+    label_count = max(1, size // label_every)
+    label_addresses = []
+    address = 0
+    lines = []
+    for i in range(size):
+        if i and i % org_every == 0:
+            address += org_gap
+            lines.append(f"ORG {address:#x}\n")
+        if i % label_every == 0:
+            lines.append(f"L{i // label_every}:\n")
+            label_addresses.append(address)
+        lines.append(random_instruction(config, rng.choice(names), rng,
+                                        label_count, label_addresses) + "\n")
+        address += 1
+        if len(lines) >= 4096:
+            fout.writelines(lines)
+            lines = []
+    fout.writelines(lines)
+
+
+def random_instruction(config, name, rng, label_count, label_addresses):
+    encoder = config.encoders[name]
+    textformat = config.textformats[config.instr_map[name][2]]
+    operands = [None] * len(textformat.fields)
+    here = len(label_addresses)
+    for index, kind, shift, mask in encoder.slots:
+        # labels defined so far whose address fits the field
+        low = bisect.bisect_right(label_addresses, mask)
+        if kind == OPERAND_IMM:
+            if encoder.relative:
+                near = rng.randrange(max(0, here - 32),
+                                     min(label_count, here + 32))
+                value = f"L{near}"
+            elif low and rng.random() < 0.1:
+                value = f"L{rng.randrange(low)}"
+            else:
+                value = str(rng.randrange(-(mask >> 1), mask >> 1))
+        else:
+            value = f"r{rng.randrange(mask + 1)}"
+        if operands[index] is None:
+            operands[index] = value
+        elif kind == OPERAND_BASE_REG:
+            operands[index] = f"{operands[index]}({value})"
+        else:
+            operands[index] = f"{value}({operands[index]})"
+    operands = [op if op is not None else "0" for op in operands[1:]]
+    if not operands:
+        return f"    {name}"
+    return f"    {name} " + ", ".join(operands)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+# runs every phase on one program, meant to run in its own process so the
+# peak rss belongs to this size only
+def run_one(config_file, size, seed, mode):
+    config = Config(config_file)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "bench.s")
+        with open(source, "w", encoding="utf-8") as fout:
+            generate_program(config, size, fout, seed)
+        assembler = Assembler(config, mode)
+
+        times = {}
+        (instructions, _), times["tokenize"] = timed(
+            lambda: Tokenizer(config.instr_map).parse_tokens(source))
+        words = WordBuffer()
+        _, times["assemble"] = timed(
+            lambda: assembler.assemble(instructions, words))
+        _, times["write"] = timed(
+            lambda: assembler.write_runs(words.runs(),
+                                         os.path.join(tmp, "out")))
+        del words
+        two_pass = Assembler(config, mode)
+        asm_instructions, times["layout"] = timed(
+            lambda: list(two_pass.layout(instructions)))
+        _, times["encode"] = timed(
+            lambda: list(two_pass.encode(asm_instructions)))
+
+    return {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "config": config_file or "default",
+        "mode": mode,
+        "lines": size,
+        "phases": {name: {"seconds": round(seconds, 6),
+                          "lines_per_sec": round(size / seconds)
+                          if seconds else None}
+                   for name, seconds in times.items()},
+        "total_seconds": round(sum(times[name] for name in DEFAULT_PHASES),
+                               6),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def print_table(result, previous=None):
+    print(f"{result['lines']:>10} lines  peak rss "
+          f"{result['peak_rss_kb'] / 1024:.1f} MiB")
+    for name in PHASES:
+        if name not in result["phases"]:
+            continue
+        phase = result["phases"][name]
+        line = (f"    {name:<10} {phase['seconds']:>10.4f} s "
+                f"{phase['lines_per_sec'] or 0:>14,} lines/s")
+        if previous is not None and name in previous["phases"]:
+            before = previous["phases"][name]["seconds"]
+            if phase["seconds"]:
+                line += f"  {before / phase['seconds']:>6.2f}x vs previous"
+        print(line)
+
+
+# what a single -l encode with the built-in config must not import, the
+# harnesses that spawn the cli per instruction pay for every one of them
+LAZY_MODULES = ("yaml", "json", "pickle", "hashlib", "dataclasses", "numpy",
+                "configs.default", "macros", "disassembler", "linker",
+                "server", "batch", "parallel", "incremental")
+
+# imports after interpreter startup, median of the runs
+STARTUP_BUDGET_MS = 60.0
+
+
+# milliseconds spent importing after site, and every module imported, from
+# python -X importtime
+def import_times(cmd):
+    out = subprocess.run([sys.executable, "-X", "importtime"] + cmd,
+                         check=True, capture_output=True, text=True)
+    total = 0
+    started = False
+    modules = set()
+    for line in out.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        modules.add(name)
+        if fields[2].startswith("  "):
+            continue  # nested, counted in its parent
+        if started:
+            total += int(fields[1])
+        started = started or name == "site"
+    return total / 1000, modules
+
+
+# checks the cli startup against the budget and the frozen tables against
+# configs/default.py, returns whether both pass
+def check_startup(runs, budget_ms):
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "minisrc-asm.py")
+    cmd = [cli, "-l", "ldi r4, 0x87(r3)"]
+    times = []
+    modules = set()
+    for _ in range(runs):
+        ms, imported = import_times(cmd)
+        times.append(ms)
+        modules |= imported
+    median = sorted(times)[len(times) // 2]
+    eager = [name for name in LAZY_MODULES if name in modules]
+    frozen = Config().freeze() == Config(frozen=False).freeze()
+    print(json.dumps({"version": VERSION,
+                      "python": platform.python_version(),
+                      "import_ms": round(median, 3),
+                      "budget_ms": budget_ms,
+                      "eager_imports": eager,
+                      "frozen_up_to_date": frozen}))
+    return median <= budget_ms and not eager and frozen
+
+
+def setup():
+    parser = argparse.ArgumentParser("minisrc-bench")
+    parser.add_argument("-c", "--instr_config", type=str,
+                        help="The configuration to generate programs from")
+    parser.add_argument("--sizes", type=str, default="1000,10000,100000",
+                        help="Comma separated program sizes in lines "
+                        "(up to 10000000)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-x", "--hex", action="store_true",
+                        help="Benchmark hex output instead of binary")
+    parser.add_argument("--table", action="store_true",
+                        help="Print a table instead of json lines")
+    parser.add_argument("--compare", type=str,
+                        help="json lines from a previous run to compare "
+                        "against")
+    parser.add_argument("--generate", type=str,
+                        help="Only write a program of the first size to "
+                        "this file")
+    parser.add_argument("--startup", action="store_true",
+                        help="Check the import time of one cli run against "
+                        "--budget-ms, that optional modules stay unimported "
+                        "and that configs/frozen.py is up to date, exits 1 "
+                        "if not")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help="Import time budget for --startup")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Runs of the cli for --startup, the median "
+                        "is checked")
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = setup()
+    mode = "hex" if args.hex else "binary"
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(args.instr_config, args.run_one, args.seed,
+                                 mode)))
+        sys.exit()
+
+    if args.startup:
+        sys.exit(0 if check_startup(args.runs, args.budget_ms) else 1)
+
+    if args.generate is not None:
+        with open(args.generate, "w", encoding="utf-8") as fout:
+            generate_program(Config(args.instr_config), sizes[0], fout,
+                             args.seed)
+        sys.exit()
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    previous[result["lines"]] = result
+
+    for size in sizes:
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-one",
+               str(size), "--seed", str(args.seed)]
+        if args.instr_config is not None:
+            cmd += ["-c", args.instr_config]
+        if args.hex:
+            cmd.append("-x")
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        result = json.loads(out.stdout)
+        if args.table:
+            print_table(result, previous.get(size))
+        else:
+            print(json.dumps(result), flush=True)
@@ -1,17 +1,20 @@
-from dataclasses import dataclass
-from configs.default import minisrc
-import json
-import yaml
+import os
 
+VERSION = "0.7.0"
 
-@dataclass
-class Instruction:
-    name: str
-    opcode: int
-    format: str
+# compiled configs are cached here, keyed on the config file contents
+CACHE_DIR = os.environ.get(
+    "MINISRC_ASM_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "minisrc-asm"))
+
+# word sizes the data directives and images support
+WORD_SIZES = (8, 16, 32)
+
+# everything that is built from the config file
+CACHED_FIELDS = ("instr_map", "formats", "cond_map", "textformats",
+                 "encoders", "word_size")
 
 
-@dataclass
 class Field:
     name: str
     msb: int
@@ -22,8 +25,10 @@ class Field:
         self.msb = msb
         self.lsb = lsb
 
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.msb}, {self.lsb})"
+
 
-@dataclass
 class Format:
     name: str
     fields: []
@@ -32,40 +37,113 @@ class Format:
         self.name = name
         self.fields = fields
 
+    def __repr__(self):
+        return f"Format({self.name!r}, {self.fields!r})"
+
+
+# how an operand slot is read out of the text instruction
+OPERAND_REG = 0       # "r4"
+OPERAND_BASE_REG = 1  # register part of "0x87(r3)"
+OPERAND_IMM = 2       # immediate, "0x87(r3)" offset or a tag
+
+
+class Encoder:
+    # bits that do not depend on the operands (opcode, condition)
+    fixed: int
+    # (text operand index, operand kind, shift, mask) per operand field
+    slots: tuple
+    # labels in immediates are relative to the next instruction (branches)
+    relative: bool
+    # operands in the text instruction
+    operands: int
+
+    def __init__(self, fixed, slots, relative=False, operands=0):
+        self.fixed = fixed
+        self.slots = slots
+        self.relative = relative
+        self.operands = operands
+
+    def __repr__(self):
+        return (f"Encoder({self.fixed}, {self.slots!r}, {self.relative}, "
+                f"{self.operands})")
+
+    def __eq__(self, other):
+        return (isinstance(other, Encoder) and self.fixed == other.fixed
+                and self.slots == other.slots
+                and self.relative == other.relative
+                and self.operands == other.operands)
+
 
 class Config:
-    instr_map = {}
-    formats = {}
-    cond_map = {}
-    textformats = {}
-
-    # instruction config parseing
-    def __init__(self, filename=None, useyaml=False):
-        config = minisrc
-        if filename is not None:
-            if filename.endswith("yaml") | filename.endswith("yml") | useyaml:
-                try:
-                    f = open(filename, 'r')
-                    config = yaml.safe_load(f)
-                    f.close()
-                except yaml.YAMLError as exc:
-                    print("Error in yaml config file: ", exc)
-                    if hasattr(exc, 'problem_mark'):
-                        if exc.context is not None:
-                            print('  parser says\n' + str(exc.problem_mark))
-                            print('   '+str(exc.problem)+' '+str(exc.context))
-                            print("Please correct data and retry")
-                        else:
-                            print('  parser says\n' + str(exc.problem_mark))
-                            print('   '+str(exc.problem))
-                            print("Please correct data and retry")
+    instr_map: dict
+    formats: dict
+    cond_map: dict
+    textformats: dict
+    encoders: dict
+    word_size: int  # bits in a word, the unit of addresses
+
+    # instruction config parseing. without a file the built-in Mini SRC
+    # config is used, from its frozen tables unless frozen is False
+    def __init__(self, filename=None, useyaml=False, cache=True, frozen=True):
+        self.instr_map = {}
+        self.formats = {}
+        self.cond_map = {}
+        self.textformats = {}
+        self.encoders = {}
+        self.word_size = 32
+
+        if filename is None:
+            if not frozen or not self.load_frozen():
+                from configs.default import minisrc
+                self.build(minisrc)
+            return
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+        useyaml = (filename.endswith("yaml") | filename.endswith("yml")
+                   | useyaml)
+        cache_file = None
+        if cache:
+            cache_file = self.cache_path(data, useyaml)
+            if self.load_cache(cache_file):
+                return
+
+        if useyaml:
+            import yaml
+            try:
+                config = yaml.safe_load(data)
+            except yaml.YAMLError as exc:
+                print("Error in yaml config file: ", exc)
+                if hasattr(exc, 'problem_mark'):
+                    if exc.context is not None:
+                        print('  parser says\n' + str(exc.problem_mark))
+                        print('   '+str(exc.problem)+' '+str(exc.context))
+                        print("Please correct data and retry")
                     else:
-                        print("Something went wrong while parsing yaml file")
+                        print('  parser says\n' + str(exc.problem_mark))
+                        print('   '+str(exc.problem))
+                        print("Please correct data and retry")
+                else:
+                    print("Something went wrong while parsing yaml file")
+                raise ValueError(f"invalid yaml config {filename}") from exc
 
-            elif filename.endswith("json") | True:
-                f = open(filename)
-                config = json.load(f)
-                f.close()
+        else:
+            import json
+            config = json.loads(data)
+
+        self.build(config)
+        if cache_file is not None:
+            self.save_cache(cache_file)
+
+    def build(self, config):
+        # configs from before data directives only had word_size as a note
+        # (sometimes a string), words stay 32 bits unless it is a size the
+        # data directives can pack bytes into
+        try:
+            word_size = int(config.get("word_size", 32))
+        except (TypeError, ValueError):
+            word_size = 32
+        self.word_size = word_size if word_size in WORD_SIZES else 32
 
         for instr in config["instructions"]:
             self.instr_map[instr["name"]] = (instr["opcode"], instr["format"],
@@ -83,3 +161,141 @@ class Config:
 
         for tf in config["textformats"]:
             self.textformats[tf["name"]] = Format(tf["name"], tf["fields"])
+
+        for name in self.instr_map:
+            self.encoders[name] = self.compile_encoder(name)
+
+    # the built-in Mini SRC tables are compiled ahead of time into
+    # configs/frozen.py (python3 config.py --freeze), so the default config
+    # costs one import. a table frozen by another version is rebuilt instead
+    def load_frozen(self):
+        try:
+            from configs.frozen import FROZEN_VERSION, minisrc
+        except ImportError:
+            minisrc = None
+        if minisrc is None or FROZEN_VERSION != VERSION:
+            return False
+        self.word_size = minisrc["word_size"]
+        self.instr_map = minisrc["instr_map"]
+        self.cond_map = minisrc["cond_map"]
+        self.formats = {name: Format(name, [Field(*field) for field in fields])
+                        for name, fields in minisrc["formats"].items()}
+        self.textformats = {name: Format(name, fields)
+                            for name, fields in minisrc["textformats"].items()}
+        self.encoders = {name: Encoder(*encoder)
+                         for name, encoder in minisrc["encoders"].items()}
+        return True
+
+    def freeze(self):
+        return {
+            "word_size": self.word_size,
+            "instr_map": self.instr_map,
+            "cond_map": self.cond_map,
+            "formats": {name: [(f.name, f.msb, f.lsb) for f in format.fields]
+                        for name, format in self.formats.items()},
+            "textformats": {name: format.fields
+                            for name, format in self.textformats.items()},
+            "encoders": {name: (e.fixed, e.slots, e.relative, e.operands)
+                         for name, e in self.encoders.items()},
+        }
+
+    # identifies the encoding tables, for caches of encoded output
+    def fingerprint(self):
+        import hashlib
+        tables = repr((self.encoders, self.word_size)).encode()
+        return hashlib.sha256(tables).hexdigest()
+
+    # the cache key covers the file contents, how it is parsed and the tool
+    # version, so editing the config or upgrading invalidates the cache
+    @staticmethod
+    def cache_path(data, useyaml):
+        import hashlib
+        key = hashlib.sha256(data)
+        key.update(f"{VERSION}:{useyaml}".encode())
+        return os.path.join(CACHE_DIR, key.hexdigest() + ".pickle")
+
+    def load_cache(self, cache_file):
+        import pickle
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            fields = [cached[name] for name in CACHED_FIELDS]
+        except Exception:
+            # missing, truncated or from an incompatible version, rebuild it
+            return False
+        for name, value in zip(CACHED_FIELDS, fields):
+            setattr(self, name, value)
+        return True
+
+    # the cache is only an optimization, failing to write it is not an error
+    def save_cache(self, cache_file):
+        import pickle
+        cached = {name: getattr(self, name) for name in CACHED_FIELDS}
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+
+    # precompute everything get_instr_bin needs so that encoding is a loop
+    # over the operand slots
+    def compile_encoder(self, name):
+        opcode, format, textformat = self.instr_map[name]
+        tf_fields = self.textformats[textformat].fields
+        fixed = 0
+        slots = []
+        relative = False
+        for field in self.formats[format].fields:
+            mask = ((1 << (field.msb + 1)) - (1 << field.lsb)) >> field.lsb
+            # gets the index of the binary field in the text instruction field
+            index = None
+            for i, textfield in enumerate(tf_fields):
+                if field.name in textfield:
+                    index = i
+
+            # no index found, just go next or do branch condition
+            if index is None:
+                if "condition" == field.name:
+                    relative = True
+                    if name not in self.cond_map:
+                        raise ValueError(f"no condition value for {name}")
+                    fixed |= (self.cond_map[name] & mask) << field.lsb
+                continue
+
+            if "op" in field.name:
+                fixed |= (opcode & mask) << field.lsb
+            elif "R" in field.name and "imm" not in tf_fields[index]:
+                slots.append((index, OPERAND_REG, field.lsb, mask))
+            elif "R" in field.name and "imm" in tf_fields[index]:
+                slots.append((index, OPERAND_BASE_REG, field.lsb, mask))
+            elif "imm" in field.name:
+                slots.append((index, OPERAND_IMM, field.lsb, mask))
+            else:
+                raise ValueError("invalid field in config")
+        return Encoder(fixed, tuple(slots), relative, len(tf_fields) - 1)
+
+
+# regenerates configs/frozen.py from configs/default.py
+def write_frozen(path=None):
+    from pprint import pformat
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "configs", "frozen.py")
+    tables = pformat(Config(frozen=False).freeze(), width=79,
+                     sort_dicts=False)
+    with open(path, "w", encoding="utf-8") as fout:
+        fout.write("# generated by python3 config.py --freeze from "
+                   "configs/default.py, do not edit\n")
+        fout.write(f"FROZEN_VERSION = {VERSION!r}\n\n")
+        fout.write(f"minisrc = {tables}\n")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["--freeze"]:
+        write_frozen()
+    else:
+        sys.exit("usage: python3 config.py --freeze")
@@ -0,0 +1,146 @@
+# generated by python3 config.py --freeze from configs/default.py, do not edit
+FROZEN_VERSION = '0.7.0'
+
+minisrc = {'word_size': 32,
+ 'instr_map': {'ld': (0, 'I', 'load'),
+               'ldi': (1, 'I', 'load'),
+               'st': (2, 'I', 'store'),
+               'add': (3, 'R', 'arithmetic'),
+               'sub': (4, 'R', 'arithmetic'),
+               'shr': (5, 'R', 'arithmetic'),
+               'shra': (6, 'R', 'arithmetic'),
+               'shl': (7, 'R', 'arithmetic'),
+               'ror': (8, 'R', 'arithmetic'),
+               'rol': (9, 'R', 'arithmetic'),
+               'and': (10, 'R', 'arithmetic'),
+               'or': (11, 'R', 'arithmetic'),
+               'addi': (12, 'I', 'arithmetic_immediate'),
+               'andi': (13, 'I', 'arithmetic_immediate'),
+               'ori': (14, 'I', 'arithmetic_immediate'),
+               'mul': (15, 'I', 'two_reg'),
+               'div': (16, 'I', 'two_reg'),
+               'neg': (17, 'I', 'two_reg'),
+               'not': (18, 'I', 'two_reg'),
+               'brzr': (19, 'B', 'branch'),
+               'brnz': (19, 'B', 'branch'),
+               'brpl': (19, 'B', 'branch'),
+               'brmi': (19, 'B', 'branch'),
+               'jr': (20, 'J', 'one_reg'),
+               'jal': (21, 'J', 'one_reg'),
+               'in': (22, 'J', 'one_reg'),
+               'out': (23, 'J', 'one_reg'),
+               'mfhi': (24, 'J', 'one_reg'),
+               'mflo': (25, 'J', 'one_reg'),
+               'nop': (26, 'M', 'misc'),
+               'halt': (27, 'M', 'misc')},
+ 'cond_map': {'brzr': 0, 'brnz': 1, 'brpl': 2, 'brmi': 3},
+ 'formats': {'R': [('opcode', 31, 27),
+                   ('Ra', 26, 23),
+                   ('Rb', 22, 19),
+                   ('Rc', 18, 15)],
+             'I': [('opcode', 31, 27),
+                   ('Ra', 26, 23),
+                   ('Rb', 22, 19),
+                   ('c_imm', 18, 0)],
+             'B': [('opcode', 31, 27),
+                   ('Ra', 26, 23),
+                   ('condition', 22, 19),
+                   ('c_imm', 18, 0)],
+             'J': [('opcode', 31, 27), ('Ra', 26, 23)],
+             'M': [('opcode', 31, 27)]},
+ 'textformats': {'load': ['opcode', 'Ra', 'Rb_c_imm'],
+                 'store': ['opcode', 'c_imm_Rb', 'Ra'],
+                 'arithmetic': ['opcode', 'Ra', 'Rb', 'Rc'],
+                 'arithmetic_immediate': ['opcode', 'Ra', 'Rb', 'c_imm'],
+                 'two_reg': ['opcode', 'Ra', 'Rb'],
+                 'branch': ['opcode', 'Ra', 'c_imm'],
+                 'one_reg': ['opcode', 'Ra'],
+                 'misc': ['opcode']},
+ 'encoders': {'ld': (0,
+                     ((1, 0, 23, 15), (2, 1, 19, 15), (2, 2, 0, 524287)),
+                     False,
+                     2),
+              'ldi': (134217728,
+                      ((1, 0, 23, 15), (2, 1, 19, 15), (2, 2, 0, 524287)),
+                      False,
+                      2),
+              'st': (268435456,
+                     ((2, 0, 23, 15), (1, 1, 19, 15), (1, 2, 0, 524287)),
+                     False,
+                     2),
+              'add': (402653184,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'sub': (536870912,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'shr': (671088640,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'shra': (805306368,
+                       ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                       False,
+                       3),
+              'shl': (939524096,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'ror': (1073741824,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'rol': (1207959552,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'and': (1342177280,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                      False,
+                      3),
+              'or': (1476395008,
+                     ((1, 0, 23, 15), (2, 0, 19, 15), (3, 0, 15, 15)),
+                     False,
+                     3),
+              'addi': (1610612736,
+                       ((1, 0, 23, 15), (2, 0, 19, 15), (3, 2, 0, 524287)),
+                       False,
+                       3),
+              'andi': (1744830464,
+                       ((1, 0, 23, 15), (2, 0, 19, 15), (3, 2, 0, 524287)),
+                       False,
+                       3),
+              'ori': (1879048192,
+                      ((1, 0, 23, 15), (2, 0, 19, 15), (3, 2, 0, 524287)),
+                      False,
+                      3),
+              'mul': (2013265920, ((1, 0, 23, 15), (2, 0, 19, 15)), False, 2),
+              'div': (2147483648, ((1, 0, 23, 15), (2, 0, 19, 15)), False, 2),
+              'neg': (2281701376, ((1, 0, 23, 15), (2, 0, 19, 15)), False, 2),
+              'not': (2415919104, ((1, 0, 23, 15), (2, 0, 19, 15)), False, 2),
+              'brzr': (2550136832,
+                       ((1, 0, 23, 15), (2, 2, 0, 524287)),
+                       True,
+                       2),
+              'brnz': (2550661120,
+                       ((1, 0, 23, 15), (2, 2, 0, 524287)),
+                       True,
+                       2),
+              'brpl': (2551185408,
+                       ((1, 0, 23, 15), (2, 2, 0, 524287)),
+                       True,
+                       2),
+              'brmi': (2551709696,
+                       ((1, 0, 23, 15), (2, 2, 0, 524287)),
+                       True,
+                       2),
+              'jr': (2684354560, ((1, 0, 23, 15),), False, 1),
+              'jal': (2818572288, ((1, 0, 23, 15),), False, 1),
+              'in': (2952790016, ((1, 0, 23, 15),), False, 1),
+              'out': (3087007744, ((1, 0, 23, 15),), False, 1),
+              'mfhi': (3221225472, ((1, 0, 23, 15),), False, 1),
+              'mflo': (3355443200, ((1, 0, 23, 15),), False, 1),
+              'nop': (3489660928, (), False, 0),
+              'halt': (3623878656, (), False, 0)}}
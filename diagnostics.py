@@ -0,0 +1,79 @@
+class Diagnostic:
+    __slots__ = ("file", "line", "col", "message")
+
+    # line and col count from 0 like the tokens, they are printed from 1
+    def __init__(self, file, line, col, message):
+        self.file = file
+        self.line = line
+        self.col = col
+        self.message = message
+
+    def __str__(self):
+        where = self.file or "<input>"
+        if self.line is not None:
+            where += f":{self.line + 1}"
+            if self.col is not None:
+                where += f":{self.col + 1}"
+        return f"{where}: error: {self.message}"
+
+    def to_dict(self):
+        return {"file": self.file,
+                "line": None if self.line is None else self.line + 1,
+                "col": None if self.col is None else self.col + 1,
+                "message": self.message}
+
+
+# an error in one line of the source, raised where the line is encoded and
+# turned into a diagnostic by whoever assembles the file
+class SourceError(ValueError):
+    token: object  # the token at fault, or None for the whole line
+    file: str  # set by the preprocessor for errors in an included file
+
+    def __init__(self, message, token=None):
+        super().__init__(message)
+        self.token = token
+        self.file = None
+
+
+# every error found while assembling a file, raised once at the end (or
+# when max_errors is reached)
+class AssemblyError(ValueError):
+    diagnostics: list
+
+    def __init__(self, diagnostics, stopped=False):
+        self.diagnostics = diagnostics
+        self.stopped = stopped
+        super().__init__(str(self))
+
+    def __str__(self):
+        lines = [str(diagnostic) for diagnostic in self.diagnostics]
+        count = len(self.diagnostics)
+        summary = f"{count} error" + ("s" if count != 1 else "")
+        if self.stopped:
+            summary += ", stopped at --max-errors"
+        return "\n".join(lines + [summary])
+
+    def to_json(self):
+        import json
+        return json.dumps([d.to_dict() for d in self.diagnostics])
+
+
+class Diagnostics:
+    errors: list
+    max_errors: int  # stop after this many errors, None for no limit
+
+    def __init__(self, max_errors=None):
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, file, line, col, message):
+        self.errors.append(Diagnostic(file, line, col, message))
+        if self.max_errors is not None and len(self.errors) >= self.max_errors:
+            raise AssemblyError(self.errors, stopped=True)
+
+    # raises everything collected so far, if anything
+    def check(self):
+        if self.errors:
+            errors = self.errors
+            self.errors = []
+            raise AssemblyError(errors)
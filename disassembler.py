@@ -0,0 +1,156 @@
+import mmap
+import sys
+from array import array
+from config import OPERAND_IMM
+from writer import TYPECODES
+
+# words decoded per chunk when reading images
+CHUNK_WORDS = 1 << 16
+
+
+def field_mask(field):
+    return ((1 << (field.msb + 1)) - (1 << field.lsb)) >> field.lsb
+
+
+def sign_extend(value, mask):
+    sign = (mask + 1) >> 1
+    return (value ^ sign) - sign
+
+
+# turns words back into assembly text. the decode index maps the value of the
+# opcode field to the instructions that use it, and when several share an
+# opcode (branches) the condition field picks one, so every word is decoded
+# with a couple of dict lookups
+class Disassembler:
+    config: object
+    # (opcode shift, opcode mask, {opcode: candidate}) per opcode position
+    index: list
+
+    def __init__(self, config):
+        self.config = config
+        self.index = []
+        layouts = {}
+        for name, (opcode, format, textformat) in config.instr_map.items():
+            op_field = None
+            cond_field = None
+            for field in config.formats[format].fields:
+                if "op" in field.name and op_field is None:
+                    op_field = field
+                elif field.name == "condition":
+                    cond_field = field
+            if op_field is None:
+                continue
+            key = (op_field.lsb, field_mask(op_field))
+            candidates = layouts.setdefault(key, {}).setdefault(
+                opcode & key[1], [])
+            candidates.append((name, cond_field))
+
+        for (shift, mask), opcodes in layouts.items():
+            table = {}
+            for opcode, candidates in opcodes.items():
+                table[opcode] = self.candidate(candidates)
+            self.index.append((shift, mask, table))
+
+    # a single instruction name, or (shift, mask, {condition: name}) when
+    # several instructions share the opcode
+    def candidate(self, candidates):
+        name, cond_field = candidates[0]
+        if len(candidates) == 1 or cond_field is None:
+            return name
+        shift = cond_field.lsb
+        mask = field_mask(cond_field)
+        conditions = {}
+        for name, field in candidates:
+            if field is None or (field.lsb, field_mask(field)) != (shift, mask):
+                raise ValueError(f"can not tell {candidates[0][0]} and "
+                                 f"{name} apart")
+            conditions.setdefault(self.config.cond_map[name] & mask, name)
+        return (shift, mask, conditions)
+
+    def lookup(self, word):
+        for shift, mask, table in self.index:
+            match table.get((word >> shift) & mask):
+                case str(name):
+                    return name
+                case (cshift, cmask, conditions):
+                    if (name := conditions.get((word >> cshift) & cmask)):
+                        return name
+        return None
+
+    # returns the assembly text of a word, or None if no instruction matches
+    def decode(self, word):
+        name = self.lookup(word)
+        if name is None:
+            return None
+        encoder = self.config.encoders[name]
+        textformat = self.config.textformats[self.config.instr_map[name][2]]
+        regs = {}
+        imms = {}
+        for index, kind, shift, mask in encoder.slots:
+            value = (word >> shift) & mask
+            if kind == OPERAND_IMM:
+                imms[index] = sign_extend(value, mask)
+            else:
+                regs[index] = value
+
+        operands = []
+        for index in range(1, len(textformat.fields)):
+            if index in imms and index in regs:
+                operands.append(f"{imms[index]}(r{regs[index]})")
+            elif index in imms:
+                operands.append(str(imms[index]))
+            elif index in regs:
+                operands.append(f"r{regs[index]}")
+            else:
+                operands.append("0")
+        if operands:
+            return f"{name} " + ", ".join(operands)
+        return name
+
+    def disassemble_file(self, file_in, fout, mode="binary", byteorder="big",
+                         skip_zeros=False):
+        address = 0
+        word_size = self.config.word_size
+        digits = word_size // 4
+        for words in iter_words(file_in, mode, byteorder, word_size):
+            lines = []
+            for word in words:
+                if word or not skip_zeros:
+                    text = self.decode(word)
+                    if text is None:
+                        text = f".word {word:#0{digits + 2}x}"
+                    lines.append(f"{address:#0{10}x}: {word:0{digits}x}  "
+                                 f"{text}\n")
+                address += 1
+            fout.writelines(lines)
+
+
+# yields the words of an image in chunks. binary images are memory mapped so
+# huge dumps are never read into memory at once
+def iter_words(file_in, mode="binary", byteorder="big", word_size=32):
+    if mode == "binary":
+        word_bytes = word_size // 8
+        chunk = CHUNK_WORDS * word_bytes
+        with open(file_in, "rb") as f:
+            if f.seek(0, 2) == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm) - len(mm) % word_bytes
+                for start in range(0, size, chunk):
+                    words = array(TYPECODES[word_bytes],
+                                  mm[start:min(start + chunk, size)])
+                    if word_bytes > 1 and byteorder != sys.byteorder:
+                        words.byteswap()
+                    yield words if word_bytes == 4 else array("I", words)
+    else:
+        base = 2 if mode == "binnum" else 16
+        with open(file_in, "r", encoding="utf-8") as f:
+            words = []
+            for line in f:
+                if line.strip():
+                    words.append(int(line, base))
+                if len(words) >= CHUNK_WORDS:
+                    yield words
+                    words = []
+            if words:
+                yield words
@@ -0,0 +1,199 @@
+import re
+
+# numbers, names and operators of an immediate expression, whitespace is not
+# allowed inside operands so there is none to skip
+LEXEME = re.compile(r"(0[xX][0-9a-fA-F]+|0[bB][01]+|[0-9]+)"
+                    r"|([A-Za-z_.$][\w.$]*)|(<<|>>|[-+*&|~()])")
+
+# binary operators from the loosest to the tightest binding
+PRECEDENCE = {"|": 1, "&": 2, "<<": 3, ">>": 3, "+": 4, "-": 4, "*": 5}
+
+OPERATORS = {
+    "|": lambda a, b: a | b,
+    "&": lambda a, b: a & b,
+    "<<": lambda a, b: a << b,
+    ">>": lambda a, b: a >> b,
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "neg": lambda a: -a,
+    "~": lambda a: ~a,
+}
+
+# distinct expressions remembered before the cache is reset
+EXPRESSION_CACHE_SIZE = 1 << 16
+
+
+# an expression that still references labels once every constant known
+# when it was parsed is folded in. tree is an int, a name, or
+# (operator, operands...)
+class Expression:
+    __slots__ = ("text", "tree", "names", "value")
+
+    def __init__(self, text, tree, names):
+        self.text = text
+        self.tree = tree
+        self.names = names
+        self.value = None  # once every name is defined
+
+    def __repr__(self):
+        return f"Expression({self.text})"
+
+
+# parses immediates like "table+4" or "(SIZE<<2)|1" once per distinct text.
+# parts that only use numbers and constants are folded while parsing, so a
+# constant expression is an int from then on and a label expression keeps
+# the rest for when its labels are known
+class Evaluator:
+    symbols: dict  # label -> address
+    constants: dict  # .equ/.set name -> value
+    cache: dict  # text -> int or Expression
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols if symbols is not None else {}
+        self.constants = {}
+        self.cache = {}
+
+    def parse(self, text):
+        if (cached := self.cache.get(text)) is not None:
+            return cached
+        if len(self.cache) >= EXPRESSION_CACHE_SIZE:
+            self.cache.clear()
+        lexemes = self.lex(text)
+        tree, i = self.binary(lexemes, 0, 1, text)
+        if i != len(lexemes):
+            raise ValueError(f"invalid expression {text}")
+        if type(tree) is not int:
+            names = []
+            self.collect(tree, names)
+            tree = Expression(text, tree, tuple(names))
+        self.cache[text] = tree
+        return tree
+
+    def lex(self, text):
+        lexemes = []
+        pos = 0
+        while pos < len(text):
+            match = LEXEME.match(text, pos)
+            if match is None:
+                raise ValueError(f"invalid expression {text}")
+            number, name, operator = match.groups()
+            if number is not None:
+                prefixed = number[:2].lower() in ("0x", "0b")
+                lexemes.append(int(number, 0 if prefixed else 10))
+            elif name is not None:
+                lexemes.append(("name", name))
+            else:
+                lexemes.append(operator)
+            pos = match.end()
+        return lexemes
+
+    # precedence climbing, returns (tree, index of the next lexeme)
+    def binary(self, lexemes, i, level, text):
+        left, i = self.unary(lexemes, i, text)
+        while i < len(lexemes):
+            operator = lexemes[i]
+            prec = PRECEDENCE.get(operator) if type(operator) is str else None
+            if prec is None or prec < level:
+                break
+            right, i = self.binary(lexemes, i + 1, prec + 1, text)
+            left = self.fold(operator, left, right)
+        return left, i
+
+    def unary(self, lexemes, i, text):
+        if i >= len(lexemes):
+            raise ValueError(f"invalid expression {text}")
+        lexeme = lexemes[i]
+        if lexeme == "-" or lexeme == "~":
+            operand, i = self.unary(lexemes, i + 1, text)
+            return self.fold("neg" if lexeme == "-" else "~", operand), i
+        if lexeme == "+":
+            return self.unary(lexemes, i + 1, text)
+        if lexeme == "(":
+            tree, i = self.binary(lexemes, i + 1, 1, text)
+            if i >= len(lexemes) or lexemes[i] != ")":
+                raise ValueError(f"unbalanced parentheses in {text}")
+            return tree, i + 1
+        if type(lexeme) is int:
+            return lexeme, i + 1
+        if type(lexeme) is tuple:
+            return self.constants.get(lexeme[1], lexeme), i + 1
+        raise ValueError(f"invalid expression {text}")
+
+    @staticmethod
+    def fold(operator, *operands):
+        if all(type(operand) is int for operand in operands):
+            return OPERATORS[operator](*operands)
+        return (operator,) + operands
+
+    def collect(self, tree, names):
+        if type(tree) is not tuple:
+            return
+        if tree[0] == "name":
+            if tree[1] not in names:
+                names.append(tree[1])
+            return
+        for operand in tree[1:]:
+            self.collect(operand, names)
+
+    # the value of an expression, None while one of its names is undefined.
+    # labels never move once defined so the value is only computed once
+    def evaluate(self, expression):
+        if type(expression) is int:
+            return expression
+        if expression.value is None:
+            expression.value = self.compute(expression.tree)
+        return expression.value
+
+    def compute(self, tree):
+        if type(tree) is int:
+            return tree
+        if tree[0] == "name":
+            name = tree[1]
+            if (value := self.constants.get(name)) is None:
+                value = self.symbols.get(name)
+            return value
+        operands = []
+        for operand in tree[1:]:
+            if (value := self.compute(operand)) is None:
+                return None
+            operands.append(value)
+        return OPERATORS[tree[0]](*operands)
+
+    # text of what is left of an expression after folding, for evaluating it
+    # somewhere the constants are not known (object files)
+    def residual(self, expression):
+        return self.unparse(expression.tree)
+
+    def unparse(self, tree):
+        if type(tree) is int:
+            return str(tree) if tree >= 0 else f"({tree})"
+        if tree[0] == "name":
+            return tree[1]
+        if tree[0] == "neg":
+            return f"(-{self.unparse(tree[1])})"
+        if tree[0] == "~":
+            return f"(~{self.unparse(tree[1])})"
+        return f"({self.unparse(tree[1])}{tree[0]}{self.unparse(tree[2])})"
+
+    # the first name an expression is waiting for
+    def missing(self, expression):
+        for name in expression.names:
+            if name not in self.constants and name not in self.symbols:
+                return name
+        return None
+
+    # .equ defines a constant once, .set can change it. earlier expressions
+    # were folded with the old value so the cache starts over
+    def define(self, name, text, redefine=False):
+        if name in self.symbols:
+            raise ValueError(f"constant {name} is already a label")
+        if name in self.constants and not redefine:
+            raise ValueError(f"constant {name} defined twice")
+        value = self.evaluate(self.parse(text))
+        if value is None:
+            raise ValueError(f"{text} is not defined yet")
+        if name in self.constants and self.constants[name] != value:
+            self.cache.clear()
+        self.constants[name] = value
+        return value
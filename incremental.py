@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+from assembler import Tokenizer, parse_int, split_base
+from config import OPERAND_IMM, VERSION
+from writer import FORMATS, ImageWriter
+
+
+# hash of everything that the encoding of an instruction depends on besides
+# the tags it references
+def line_digest(instruction):
+    text = " ".join(token.value for token in instruction)
+    return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+
+# re-assembles a file but only re-encodes the instructions whose text changed
+# or that reference a tag that moved. the state of the previous run is kept
+# in a sidecar file next to the output, and the output image is patched in
+# place when the layout of the program did not change
+class IncrementalAssembler:
+    state_file: str
+    encoded: int  # instructions encoded on the last run
+    reused: int  # instructions taken from the previous run
+
+    def __init__(self, assembler):
+        self.assembler = assembler
+        self.encoded = 0
+        self.reused = 0
+
+    def fingerprint(self):
+        asm = self.assembler
+        return (VERSION, asm.mode, asm.byteorder, asm.config.fingerprint())
+
+    def load_state(self):
+        try:
+            with open(self.state_file, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            return None
+        if state.get("fingerprint") != self.fingerprint():
+            return None
+        return state
+
+    def save_state(self, state):
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.state_file)
+
+    # labels referenced by the immediate operands of an instruction
+    def tag_operands(self, instruction):
+        tags = self.assembler.tags
+        expressions = self.assembler.expressions
+        encoder = self.assembler.config.encoders[instruction[0].value]
+        deps = []
+        for index, kind, shift, mask in encoder.slots:
+            if kind == OPERAND_IMM:
+                token = split_base(instruction[index].value)[0]
+                if token in tags:
+                    deps.append((token, tags[token]))
+                elif parse_int(token.lower()) is None:
+                    expression = expressions.parse(token)
+                    if type(expression) is not int:
+                        deps.extend((name, tags.get(name))
+                                    for name in expression.names)
+        return tuple(deps)
+
+    def convert_text_file(self, file_in, file_out):
+        asm = self.assembler
+        self.state_file = file_out + ".state"
+        self.encoded = 0
+        self.reused = 0
+
+        tokenizer = Tokenizer(asm.config.instr_map)
+        instructions, comments = tokenizer.parse_tokens(file_in)
+        asm_instructions = list(asm.layout(asm.preprocess(
+            tokenizer, instructions, file_in)))
+
+        old = self.load_state()
+        constants = asm.expressions.constants
+        # constants are folded into the words, changing one re-encodes all
+        if (old is None or not os.path.exists(file_out)
+                or old.get("constants") != constants):
+            old_lines = {}
+        else:
+            old_lines = old["lines"]
+
+        lines = {}
+        changed = []
+        for addr, instruction in asm_instructions:
+            if instruction[0].t_type == "directive":
+                # data is rebuilt in bulk and always rewritten, an .incbin
+                # file can change without the source changing
+                for addr, word in enumerate(asm.data(instruction, addr),
+                                            addr):
+                    lines[addr] = (None, word)
+                    changed.append((addr, word))
+                continue
+            digest = line_digest(instruction)
+            key = (digest, self.tag_operands(instruction))
+            prev = old_lines.get(addr)
+            if prev is not None and prev[0] == key:
+                word = prev[1]
+                self.reused += 1
+            else:
+                word = asm.get_instr_bin(instruction, addr)
+                changed.append((addr, word))
+                self.encoded += 1
+            lines[addr] = (key, word)
+
+        # record formats are rewritten, their words can not be patched
+        if (old_lines and lines.keys() == old_lines.keys()
+                and asm.mode not in FORMATS):
+            with ImageWriter(file_out, asm.mode, asm.byteorder, patch=True,
+                             word_size=asm.config.word_size) as fout:
+                for addr, word in changed:
+                    fout.write(addr, word)
+        else:
+            asm.write_lines(((addr, word) for addr, (key, word)
+                             in lines.items()), file_out)
+
+        self.save_state({"fingerprint": self.fingerprint(), "lines": lines,
+                         "constants": constants})
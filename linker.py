@@ -0,0 +1,321 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+from array import array
+from assembler import CONSTANTS, ORGS, Assembler, Tokenizer
+from config import CACHE_DIR, VERSION
+from diagnostics import AssemblyError, Diagnostic, SourceError
+from expressions import Evaluator
+from symbols import Fixup, fits
+
+OBJECT_FORMAT = "minisrc-obj"
+# objects from before revision 2 have no exports, every label is global
+OBJECT_REVISION = 2
+
+
+class Section:
+    org: int  # None for code that is placed by the linker
+    words: array
+
+    def __init__(self, org=None):
+        self.org = org
+        self.words = array("I")
+
+
+# one assembled source file. every label reference is left as a relocation
+# so the module can be placed anywhere and linked against other modules
+class ObjectModule:
+    name: str
+    sections: list
+    symbols: dict  # label -> (section, offset)
+    exports: list  # the labels other modules can use, from .global
+    # (section, offset, shift, mask, relative, label, expression), the
+    # expression is None when the operand is just the label
+    relocations: list
+    depends: dict  # .include/.incbin path -> sha256 of its contents
+
+    def __init__(self, name):
+        self.name = name
+        self.sections = [Section()]
+        self.symbols = {}
+        self.exports = []
+        self.relocations = []
+        self.depends = {}
+
+    def imports(self):
+        names = set()
+        evaluator = Evaluator()
+        for reloc in self.relocations:
+            if reloc[6] is None:
+                names.add(reloc[5])
+            else:
+                names.update(evaluator.parse(reloc[6]).names)
+        return names - self.symbols.keys()
+
+    # whether the included files still have the contents the module was
+    # assembled from
+    def current(self):
+        for path, digest in self.depends.items():
+            try:
+                if file_digest(path) != digest:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def to_json(self):
+        sections = []
+        for section in self.sections:
+            # words are stored big endian
+            words = array("I", section.words)
+            if sys.byteorder == "little":
+                words.byteswap()
+            sections.append({"org": section.org,
+                             "words": base64.b64encode(words).decode()})
+        return json.dumps({
+            "format": OBJECT_FORMAT,
+            "revision": OBJECT_REVISION,
+            "version": VERSION,
+            "name": self.name,
+            "sections": sections,
+            "symbols": self.symbols,
+            "exports": self.exports,
+            "relocations": self.relocations,
+            "depends": self.depends,
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if data.get("format") != OBJECT_FORMAT:
+            raise ValueError("not a minisrc object file")
+        module = cls(data["name"])
+        module.sections = []
+        for item in data["sections"]:
+            section = Section(item["org"])
+            section.words.frombytes(base64.b64decode(item["words"]))
+            if sys.byteorder == "little":
+                section.words.byteswap()
+            module.sections.append(section)
+        module.symbols = {name: tuple(loc)
+                          for name, loc in data["symbols"].items()}
+        if data.get("revision", 1) < 2:
+            module.exports = list(module.symbols)
+        else:
+            module.exports = data["exports"]
+        # objects from before expressions have no expression column
+        module.relocations = [tuple(reloc) + (None,) * (7 - len(reloc))
+                              for reloc in data["relocations"]]
+        module.depends = data.get("depends", {})
+        return module
+
+
+def compile_module(config, file_in):
+    assembler = Assembler(config)
+    module = ObjectModule(os.path.basename(file_in))
+    section = module.sections[0]
+    tokenizer = Tokenizer(config.instr_map)
+    instructions = assembler.preprocess(tokenizer,
+                                        tokenizer.iter_tokens(file_in), file_in)
+    try:
+        for instruction in instructions:
+            try:
+                if instruction[0].t_type == "tag":
+                    name = instruction[0].value
+                    if name in module.symbols:
+                        raise SourceError(f"symbol {name} defined twice",
+                                          instruction[0])
+                    module.symbols[name] = (len(module.sections) - 1,
+                                            len(section.words))
+                    instruction = instruction[1:]
+                    if not instruction:
+                        continue
+
+                match instruction[0].t_type:
+                    case "directive" if instruction[0].value in ORGS:
+                        section = Section(assembler.org(instruction))
+                        module.sections.append(section)
+                    case "directive" if instruction[0].value in CONSTANTS:
+                        assembler.constant(instruction)
+                    case "directive":
+                        refs = []
+                        words = assembler.data(instruction,
+                                               len(section.words), refs)
+                        for offset, name, expression in refs:
+                            module.relocations.append(
+                                (len(module.sections) - 1,
+                                 len(section.words) + offset, 0,
+                                 assembler.word_mask, False, name,
+                                 residual(assembler, expression)))
+                        section.words.extend(words)
+                    case "name":
+                        # no labels are known, so every label becomes a
+                        # reference
+                        refs = []
+                        section.words.append(assembler.get_instr_bin(
+                            instruction, len(section.words), refs))
+                        for (name, shift, mask, relative, expression,
+                             _) in refs:
+                            module.relocations.append(
+                                (len(module.sections) - 1,
+                                 len(section.words) - 1, shift, mask,
+                                 relative, name,
+                                 residual(assembler, expression)))
+            except (ValueError, OSError) as exc:
+                assembler.report(exc, instruction)
+    except (ValueError, OSError) as exc:
+        # from the preprocessor, which cannot go on after an error
+        assembler.report(exc, None)
+    for name, (file_name, token) in assembler.preprocessor.exports.items():
+        if name in module.symbols:
+            module.exports.append(name)
+        else:
+            assembler.diagnostics.error(file_name, token.line_num, token.col,
+                                        f"exported label {name} is not "
+                                        f"defined")
+    assembler.diagnostics.check()
+    for path in assembler.preprocessor.files:
+        module.depends[os.path.abspath(path)] = file_digest(path)
+    return module
+
+
+# constants are folded in when the module is assembled, the object only
+# keeps the part that needs labels
+def residual(assembler, expression):
+    if expression is None:
+        return None
+    return assembler.expressions.residual(expression)
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# objects are cached by source path and contents, config and tool version
+# so an unchanged module is never assembled again. includes are relative to
+# the source, so the same text elsewhere is another module. the files it
+# includes are checked against the digests kept in the object
+def object_cache_path(config, file_in, data):
+    key = hashlib.sha256(data)
+    key.update(f"{os.path.abspath(file_in)}:{VERSION}:{OBJECT_REVISION}:"
+               f"{config.fingerprint()}".encode())
+    return os.path.join(CACHE_DIR, "objects", key.hexdigest() + ".json")
+
+
+def load_module(config, file_in, cache=True):
+    if file_in.endswith(".o"):
+        with open(file_in, "r", encoding="utf-8") as f:
+            return ObjectModule.from_json(f.read())
+
+    cache_file = None
+    if cache:
+        with open(file_in, "rb") as f:
+            cache_file = object_cache_path(config, file_in, f.read())
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                module = ObjectModule.from_json(f.read())
+            if module.current():
+                module.name = os.path.basename(file_in)
+                return module
+        except Exception:
+            pass
+
+    module = compile_module(config, file_in)
+    if cache_file is not None:
+        save_object(module, cache_file)
+    return module
+
+
+def save_object(module, file_out):
+    tmp_file = f"{file_out}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(file_out) or ".", exist_ok=True)
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(module.to_json())
+        os.replace(tmp_file, file_out)
+    except OSError:
+        pass
+
+
+# places the sections in order (sections without an org follow the previous
+# section, as if the sources were one file), resolves the labels across
+# modules and patches the relocations. a module sees its own labels and the
+# exported labels of every module. returns (address, word) pairs and the
+# global symbol table. undefined or clashing symbols and relocations that do
+# not fit their field are raised together as an AssemblyError
+def link(modules):
+    symbols = {}
+    bases = []
+    scopes = []
+    errors = []
+    address = 0
+    for module in modules:
+        module_bases = []
+        for section in module.sections:
+            if section.org is not None:
+                address = section.org
+            module_bases.append(address)
+            address += len(section.words)
+        bases.append(module_bases)
+        scope = {name: module_bases[index] + offset
+                 for name, (index, offset) in module.symbols.items()}
+        scopes.append(scope)
+        for name in module.exports:
+            if name in symbols:
+                errors.append(Diagnostic(
+                    module.name, None, None,
+                    f"symbol {name} exported by more than one module"))
+                continue
+            symbols[name] = scope[name]
+
+    lines = []
+    for module, module_bases, scope in zip(modules, bases, scopes):
+        # local labels hide the exported ones. expressions remember their
+        # value, so the same text is evaluated again in every module
+        scope = {**symbols, **scope}
+        evaluator = Evaluator(scope)
+        # patched copies, the modules can be linked again
+        sections = [array("I", section.words) for section in module.sections]
+        undefined = set()
+        for (index, offset, shift, mask, relative, name,
+             expression) in module.relocations:
+            if expression is None:
+                target = scope.get(name)
+            else:
+                expression = evaluator.parse(expression)
+                target = evaluator.evaluate(expression)
+                name = evaluator.missing(expression) or name
+            if target is None:
+                undefined.add(name)
+                continue
+            address = module_bases[index] + offset
+            fixup = Fixup(None, address, shift, mask, relative)
+            if not fits(fixup.value(target), mask, relative):
+                # objects do not keep lines, the address says where it is
+                errors.append(Diagnostic(
+                    module.name, None, None,
+                    f"{name} ({fixup.value(target)}) does not fit in "
+                    f"{mask.bit_length()} bits at {address:#x}"))
+                continue
+            sections[index][offset] |= fixup.bits(target)
+        for name in sorted(undefined):
+            errors.append(Diagnostic(module.name, None, None,
+                                     f"undefined symbol {name}"))
+        for words, base in zip(sections, module_bases):
+            lines.extend(enumerate(words, base))
+    if errors:
+        raise AssemblyError(errors)
+    return lines, symbols
+
+
+def link_files(assembler, files, file_out, cache=True):
+    modules = [load_module(assembler.config, file_in, cache)
+               for file_in in files]
+    lines, symbols = link(modules)
+    assembler.tags.update(symbols)
+    if file_out:
+        assembler.write_lines(lines, file_out)
+    return symbols
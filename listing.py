@@ -0,0 +1,210 @@
+import json
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+# binary source maps start with this, then the row, file and symbol counts
+MAGIC = b"MSRCMAP1"
+HEADER = struct.Struct("<8sIII")
+
+# listing rows joined and written at once
+LISTING_CHUNK = 1 << 14
+
+
+# where every word of a program comes from, recorded by the assembler as it
+# encodes. rows are kept in parallel arrays so the map of a large program
+# stays small, the tokens of a row are only kept for a human listing
+class Listing:
+    addresses: array
+    counts: array  # words from the row's line
+    files: array  # index into names
+    lines: array  # from 0 like the tokens
+    names: list  # file names
+    file_ids: dict  # file name -> index in names
+    instructions: list  # tokens of every row, None without a listing file
+    listing_file: str
+    source_map_file: str  # json if it ends in .json, binary otherwise
+
+    def __init__(self, listing_file=None, source_map_file=None):
+        self.listing_file = listing_file
+        self.source_map_file = source_map_file
+        self.addresses = array("I")
+        self.counts = array("I")
+        self.files = array("I")
+        self.lines = array("I")
+        self.names = []
+        self.file_ids = {}
+        self.instructions = [] if listing_file is not None else None
+
+    def add(self, address, count, file_name, line, instruction):
+        file_id = self.file_ids.get(file_name)
+        if file_id is None:
+            file_id = self.file_ids[file_name] = len(self.names)
+            self.names.append(file_name)
+        self.addresses.append(address)
+        self.counts.append(count)
+        self.files.append(file_id)
+        self.lines.append(line or 0)
+        if self.instructions is not None:
+            self.instructions.append(instruction)
+
+    # row indexes in address order, rows are recorded in source order which
+    # only differs when an ORG goes back
+    def order(self):
+        addresses = self.addresses
+        if all(a <= b for a, b in zip(addresses, addresses[1:])):
+            return range(len(addresses))
+        return sorted(range(len(addresses)), key=addresses.__getitem__)
+
+    # words are every word in the order the rows were recorded (the
+    # WordBuffer of the program), only needed for a listing. comments are
+    # {(file, line): text}
+    def save(self, words, symbols, comments, word_size=32):
+        if self.listing_file is not None:
+            with open(self.listing_file, "w", encoding="utf-8") as fout:
+                self.write_listing(fout, words, symbols, comments, word_size)
+        if self.source_map_file is None:
+            return
+        if self.source_map_file.endswith(".json"):
+            with open(self.source_map_file, "w", encoding="utf-8") as fout:
+                self.write_json(fout, symbols, comments)
+        else:
+            with open(self.source_map_file, "wb") as fout:
+                self.write_binary(fout, symbols)
+
+    def write_listing(self, fout, words, symbols, comments, word_size=32):
+        digits = word_size // 4
+        width = digits + 9
+        names = self.names
+        # comments by file id and line
+        notes = {}
+        for (file_name, line), text in comments.items():
+            if (file_id := self.file_ids.get(file_name)) is not None:
+                notes.setdefault(file_id, {})[line] = text
+        rows = []
+        file_id = None
+        offset = 0
+        for address, count, file, line, instruction in zip(
+                self.addresses, self.counts, self.files, self.lines,
+                self.instructions):
+            if file != file_id:
+                file_id = file
+                file_notes = notes.get(file_id, {})
+                rows.append(f"; {names[file_id] or '<input>'}\n")
+            word = f"{words[offset]:0{digits}x}" if count else ""
+            if count > 1:
+                word += f" +{count - 1}"
+            offset += count
+            source = instruction[0].value
+            if len(instruction) > 1:
+                source += " " + ", ".join([token.value
+                                           for token in instruction[1:]])
+            if (comment := file_notes.get(line)) is not None:
+                source = f"{source:<32} ;{comment}"
+            rows.append(f"{address:08x}  {word:<{width}} {line + 1:>6}  "
+                        f"{source}\n")
+            if len(rows) >= LISTING_CHUNK:
+                fout.write("".join(rows))
+                rows = []
+        if symbols:
+            rows.append("\nsymbols\n")
+            for name, address in sorted(symbols.items(),
+                                        key=lambda item: item[1]):
+                rows.append(f"{address:08x}  {name}\n")
+        fout.write("".join(rows))
+
+    # (address, count, file, line from 1) of every row, one after the other
+    # in address order
+    def rows(self):
+        order = self.order()
+        rows = array("I", [0]) * (4 * len(order))
+        for column, values in enumerate((self.addresses, self.counts,
+                                         self.files, self.lines)):
+            if type(order) is not range:
+                values = array("I", [values[i] for i in order])
+            rows[column::4] = values
+        rows[3::4] = array("I", [line + 1 for line in rows[3::4]])
+        return rows
+
+    # map is the rows flattened, four numbers per row
+    def write_json(self, fout, symbols, comments):
+        fout.write(json.dumps({
+            "files": self.names,
+            "map": self.rows().tolist(),
+            "symbols": symbols,
+            "comments": [[self.file_ids[file_name], line + 1, text]
+                         for (file_name, line), text in comments.items()
+                         if file_name in self.file_ids]}))
+        fout.write("\n")
+
+    # header, then every file name (u16 length and utf-8), the rows as u32s
+    # and the symbols as u32 address, u16 length and the name. little endian
+    def write_binary(self, fout, symbols):
+        rows = self.rows()
+        if sys.byteorder == "big":
+            rows.byteswap()
+        parts = [HEADER.pack(MAGIC, len(self.addresses), len(self.names),
+                             len(symbols))]
+        for name in self.names:
+            data = (name or "").encode()
+            parts.append(struct.pack("<H", len(data)) + data)
+        parts.append(rows.tobytes())
+        for name, address in symbols.items():
+            data = name.encode()
+            parts.append(struct.pack("<IH", address, len(data)) + data)
+        fout.write(b"".join(parts))
+
+
+# a source map read back, for looking up where the word at an address came
+# from without the source
+class SourceMap:
+    files: list
+    addresses: array  # start of every row, sorted
+    counts: array
+    file_ids: array
+    lines: array  # from 1
+    symbols: dict
+
+    def __init__(self, files, rows, symbols):
+        self.files = files
+        self.addresses = array("I", rows[0::4])
+        self.counts = array("I", rows[1::4])
+        self.file_ids = array("I", rows[2::4])
+        self.lines = array("I", rows[3::4])
+        self.symbols = symbols
+
+    # (file, line) of the word at an address, or None
+    def lookup(self, address):
+        i = bisect_right(self.addresses, address) - 1
+        if i < 0 or address - self.addresses[i] >= self.counts[i]:
+            return None
+        return self.files[self.file_ids[i]], self.lines[i]
+
+
+def load_source_map(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        source_map = json.loads(data)
+        return SourceMap(source_map["files"], source_map["map"],
+                         source_map["symbols"])
+
+    _, row_count, file_count, symbol_count = HEADER.unpack_from(data)
+    pos = HEADER.size
+    files = []
+    for _ in range(file_count):
+        (length,) = struct.unpack_from("<H", data, pos)
+        files.append(data[pos + 2:pos + 2 + length].decode() or None)
+        pos += 2 + length
+    rows = array("I")
+    rows.frombytes(data[pos:pos + row_count * 16])
+    if sys.byteorder == "big":
+        rows.byteswap()
+    pos += row_count * 16
+    symbols = {}
+    for _ in range(symbol_count):
+        address, length = struct.unpack_from("<IH", data, pos)
+        symbols[data[pos + 6:pos + 6 + length].decode()] = address
+        pos += 6 + length
+    return SourceMap(files, rows, symbols)
@@ -0,0 +1,287 @@
+import os
+from assembler import Token, Tokenizer, parse_int
+from diagnostics import SourceError
+
+# directives handled here, the assembler never sees them
+BLOCKS = {".macro": ".endm", ".rept": ".endr"}
+ENDS = {".endm", ".endr"}
+PREPROCESSOR = {".macro", ".endm", ".rept", ".endr", ".include", ".global"}
+
+# macros calling macros and files including files
+MAX_DEPTH = 64
+
+# expansions remembered per macro, by arguments
+MACRO_CACHE_SIZE = 256
+
+
+class Macro:
+    name: str
+    params: list  # parameter names
+    defaults: dict  # parameter -> default argument
+    body: list  # (instruction, indexes of the tokens with parameters)
+    unique: bool  # uses \@, every expansion is different
+    cache: dict  # arguments -> (expanded lines, plain)
+    file: str  # where the macro is defined, its lines number from there
+
+    def __init__(self, name, params, lines, file=None):
+        self.name = name
+        self.file = file
+        self.params = []
+        self.defaults = {}
+        for param in params:
+            param, equals, default = param.partition("=")
+            self.params.append(param)
+            if equals:
+                self.defaults[param] = default
+        names = set(self.params)
+        # tokens without parameters are shared by every expansion
+        self.body = [(instruction,
+                      [i for i, token in enumerate(instruction)
+                       if token.value in names or "\\" in token.value])
+                     for instruction in lines]
+        self.unique = any("\\@" in token.value for instruction in lines
+                          for token in instruction)
+        self.cache = {}
+
+    # token is the call, for errors
+    def arguments(self, args, token=None):
+        if len(args) > len(self.params):
+            raise SourceError(f"too many arguments for macro {self.name}",
+                              token)
+        values = dict(self.defaults)
+        values.update(zip(self.params, args))
+        if (missing := [p for p in self.params if p not in values]):
+            raise SourceError(f"missing argument(s) for macro {self.name}: "
+                              + ", ".join(missing), token)
+        return values
+
+
+# expands .macro/.endm, .rept/.endr and .include between the tokenizer and
+# the assembler. everything is a generator, a repeat or a macro call yields
+# its instructions one at a time so the expanded program is never held in
+# memory, only the bodies of the blocks as they were written
+class Preprocessor:
+    tokenizer: Tokenizer
+    macros: dict  # name -> Macro
+    including: list  # files being included, to catch include cycles
+    expansions: int  # macro calls so far, replaces \@ in macro bodies
+    value: object  # function giving the value of a .rept count, or None
+    file: str  # file of the line that was yielded last, for diagnostics
+    files: list  # every .include and .incbin file, for object caching
+    # .global label -> (file, token), the labels a linked module exports
+    exports: dict
+
+    def __init__(self, tokenizer, value=None):
+        self.tokenizer = tokenizer
+        self.value = value
+        self.file = None
+        self.macros = {}
+        self.including = []
+        self.files = []
+        self.exports = {}
+        self.expansions = 0
+
+    def expand(self, instructions, file_name=None, depth=0):
+        if depth > MAX_DEPTH:
+            raise ValueError("macros or includes nested too deeply")
+        macros = self.macros
+        # blocks read their body from the same iterator
+        instructions = iter(instructions)
+        for instruction in instructions:
+            first = instruction[0]
+            if first.t_type == "tag":
+                if len(instruction) == 1:
+                    yield instruction
+                    continue
+                yield instruction[:1]
+                instruction = instruction[1:]
+                first = instruction[0]
+
+            if first.t_type == "name":
+                if (macro := macros.get(first.value)) is None:
+                    yield instruction
+                    continue
+                lines, plain = self.call(macro, instruction)
+                if not plain:
+                    lines = self.expand(lines, file_name, depth + 1)
+                if macro.file != self.file:
+                    lines = self.within(macro.file, lines)
+                yield from lines
+            elif first.value == ".incbin" and len(instruction) > 1:
+                yield self.incbin(instruction, file_name)
+            elif first.value not in PREPROCESSOR:
+                yield instruction
+            elif first.value == ".macro":
+                self.define(instruction, instructions)
+            elif first.value == ".rept":
+                count = self.count(instruction)
+                body = self.block(instructions, ".endr", first)
+                if self.plain(body):
+                    for _ in range(count):
+                        yield from body
+                else:
+                    for _ in range(count):
+                        yield from self.expand(body, file_name, depth + 1)
+            elif first.value == ".include":
+                yield from self.include(instruction, file_name, depth)
+            elif first.value == ".global":
+                self.export(instruction)
+            else:
+                raise SourceError(f"{first.value} without a block to end",
+                                  first)
+
+    # the lines up to the end of the block, nested blocks are kept whole
+    # and expanded with the body. start is the token opening the block
+    def block(self, instructions, end, start=None):
+        body = []
+        nested = []
+        for instruction in instructions:
+            first = instruction[0]
+            if first.t_type == "tag" and len(instruction) > 1:
+                first = instruction[1]
+            value = first.value
+            if value in BLOCKS:
+                nested.append(BLOCKS[value])
+            elif value in ENDS:
+                if not nested:
+                    if value != end:
+                        break
+                    return body
+                if nested.pop() != value:
+                    break
+            body.append(instruction)
+        raise SourceError(f"missing {end}", start)
+
+    # lines without macro calls or directives to expand are passed through
+    def plain(self, lines):
+        for instruction in lines:
+            first = instruction[0]
+            if first.t_type == "tag" and len(instruction) > 1:
+                first = instruction[1]
+            if (first.value in self.macros or first.value in PREPROCESSOR
+                    or first.value == ".incbin"):
+                return False
+        return True
+
+    def define(self, instruction, instructions):
+        if len(instruction) < 2:
+            raise SourceError(".macro without a name", instruction[0])
+        name = instruction[1].value
+        if name in self.macros:
+            raise SourceError(f"macro {name} defined twice", instruction[1])
+        body = self.block(instructions, ".endm", instruction[0])
+        # a cached expansion may call a macro that is only defined now
+        for macro in self.macros.values():
+            macro.cache.clear()
+        self.macros[name] = Macro(name, [token.value for token
+                                         in instruction[2:]], body, self.file)
+
+    # the body of a macro with its arguments, and whether it has anything
+    # left to expand. a macro in a repeat is usually called with the same
+    # arguments every time, so expansions are cached
+    def call(self, macro, instruction):
+        args = tuple(token.value for token in instruction[1:])
+        if (cached := macro.cache.get(args)) is not None:
+            return cached
+        values = macro.arguments(args, instruction[0])
+        self.expansions += 1
+        values["@"] = str(self.expansions)
+        # longest first so \ab is not replaced as \a
+        values = dict(sorted(values.items(), key=lambda item: -len(item[0])))
+        lines = []
+        for line, indexes in macro.body:
+            if indexes:
+                line = list(line)
+                for i in indexes:
+                    line[i] = self.substitute(line[i], values)
+                line = tuple(line)
+            lines.append(line)
+        expanded = (lines, self.plain(lines))
+        if not macro.unique:
+            if len(macro.cache) >= MACRO_CACHE_SIZE:
+                macro.cache.clear()
+            macro.cache[args] = expanded
+        return expanded
+
+    # a token that is a parameter is replaced by its argument, \name is
+    # replaced anywhere in a token (label\@, offset(\base))
+    def substitute(self, token, values):
+        word = values.get(token.value)
+        if word is None:
+            word = token.value
+            for name, value in values.items():
+                word = word.replace("\\" + name, value)
+        if token.t_type == "tag":
+            return Token("tag", word, token.line_num, token.col)
+        t_type, value = self.tokenizer.kind(word)
+        return Token(t_type, value, token.line_num, token.col)
+
+    def count(self, instruction):
+        count = None
+        token = instruction[1] if len(instruction) > 1 else instruction[0]
+        try:
+            if len(instruction) > 1 and self.value is not None:
+                count = self.value(instruction[1].value)
+            elif len(instruction) > 1:
+                count = parse_int(instruction[1].value.lower())
+        except ValueError as exc:
+            raise SourceError(str(exc), token) from None
+        if count is None or count < 0:
+            raise SourceError("invalid .rept count", token)
+        return count
+
+    # yields lines with file set to where they come from
+    def within(self, file_name, lines):
+        previous = self.file
+        self.file = file_name
+        try:
+            yield from lines
+        except SourceError as exc:
+            # the file is restored before the error is reported
+            if exc.file is None:
+                exc.file = self.file
+            raise
+        finally:
+            self.file = previous
+
+    # only the linker uses the exports, in one file every label is global
+    def export(self, instruction):
+        if len(instruction) < 2:
+            raise SourceError(".global without a label", instruction[0])
+        for token in instruction[1:]:
+            self.exports.setdefault(token.value, (self.file, token))
+
+    # files are included relative to the file including them
+    def relative(self, token, file_name):
+        path = token.value.strip("\"'")
+        if file_name is not None:
+            path = os.path.join(os.path.dirname(file_name), path)
+        return os.path.normpath(path)
+
+    def incbin(self, instruction, file_name):
+        token = instruction[1]
+        path = Token(token.t_type, self.relative(token, file_name),
+                     token.line_num, token.col)
+        self.files.append(path.value)
+        return instruction[:1] + (path,) + instruction[2:]
+
+    def include(self, instruction, file_name, depth):
+        if len(instruction) < 2:
+            raise SourceError(".include without a file", instruction[0])
+        path = self.relative(instruction[1], file_name)
+        if path in self.including:
+            raise SourceError(f"{path} includes itself", instruction[1])
+        try:
+            open(path, "rb").close()
+        except OSError as exc:
+            raise SourceError(f"can not read {path}: {exc.strerror}",
+                              instruction[1]) from None
+        self.including.append(path)
+        self.files.append(path)
+        try:
+            tokenizer = Tokenizer(self.tokenizer.mnemonics)
+            tokenizer.words = self.tokenizer.words
+            yield from self.within(path, self.expand(
+                tokenizer.iter_tokens(path), path, depth + 1))
+        finally:
+            self.including.pop()
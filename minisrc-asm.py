@@ -1,12 +1,16 @@
 import argparse
+import sys
 from config import Config
 from assembler import Assembler
+from diagnostics import AssemblyError
 
 
 def setup():
     parser = argparse.ArgumentParser("instrmaker")
-    parser.add_argument('-s', "--file_in", type=str,
-                        help="The input file to convert into a binary file")
+    parser.add_argument('-s', "--file_in", type=str, nargs="+",
+                        help="The input file to convert into a binary file. "
+                        "Several files, globs or @manifest files assemble "
+                        "each file next to its input")
     parser.add_argument('-o', "--file_out", type=str,
                         help="The output file of the resulting binary")
     parser.add_argument('-c', "--instr_config", type=str,
@@ -17,28 +21,196 @@ def setup():
                         help="Used to compile to binary instead of hex")
     parser.add_argument('-x', "--hex", action="store_true",
                         help="Used to compile to hex")
+    parser.add_argument("-f", "--format",
+                        choices=["binary", "hex", "binnum", "readmemh", "ihex",
+                                 "mif", "coe"],
+                        help="Output image format, overrides -x/-b (readmemh "
+                        "for Verilog, ihex for Intel HEX, mif and coe for "
+                        "FPGA memory initialization)")
     parser.add_argument('-v', "--verbose", action="store_true",
                         help="Show outputs when reading file")
     parser.add_argument("-y", "--use-yaml", action="store_true",
                         help="Use yaml as your configuration file")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not use the compiled configuration cache")
+    parser.add_argument("-e", "--endian", choices=["big", "little"],
+                        default="big",
+                        help="Byte order of the words in binary output")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of worker processes when assembling "
+                        "several files (default: one per cpu)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only re-encode the lines that changed since "
+                        "the last run (state is kept in <file_out>.state)")
+    parser.add_argument("-d", "--disassemble", type=str,
+                        help="Turn an image (binary, or text with -x/-b) back "
+                        "into assembly, written to -o or the terminal")
+    parser.add_argument("--skip-zeros", action="store_true",
+                        help="Leave zero words out of the disassembly")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep running and answer requests read from "
+                        "stdin, one per line")
+    parser.add_argument("--socket", type=str,
+                        help="Keep running and answer requests on this unix "
+                        "socket")
+    parser.add_argument("--numpy", action="store_true",
+                        help="Encode the whole file with numpy (falls back "
+                        "to the normal encoder if numpy is not installed)")
+    parser.add_argument("--link", action="store_true",
+                        help="Assemble every -s file (or .o object) as a "
+                        "module and link them into one image")
+    parser.add_argument("--emit-obj", action="store_true",
+                        help="Write an object file next to every -s file "
+                        "instead of an image")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Split one large file into chunks and assemble "
+                        "them on -j worker processes")
+    parser.add_argument("--stream", action="store_true",
+                        help="Assemble in one pass straight into the output "
+                        "file without loading it into memory (for very "
+                        "large sources)")
+    parser.add_argument("--listing", type=str,
+                        help="Write a listing (address, word, line, source "
+                        "and comment of every line, then the symbols) to "
+                        "this file")
+    parser.add_argument("--source-map", type=str,
+                        help="Write where every word comes from (file and "
+                        "line) and the symbols to this file, as json if it "
+                        "ends in .json and compact binary otherwise")
+    parser.add_argument("--stats", nargs="?", const="table",
+                        choices=["table", "json"],
+                        help="Print the time and memory of every phase and "
+                        "counts of lines, tokens, instructions... to stderr")
+    parser.add_argument("--max-errors", type=int,
+                        help="Stop after this many errors (by default every "
+                        "error in the file is reported)")
+    parser.add_argument("--profile", type=str,
+                        help="Run under cProfile and write the profile to "
+                        "this file (read it with python -m pstats)")
     args = parser.parse_args()
     return args
 
 
-if __name__ == "__main__":
-    args = setup()
-    config = Config(args.instr_config, useyaml=args.use_yaml)
+# glob.has_magic without importing glob for the usual single file
+def has_magic(path):
+    return any(c in path for c in "*?[")
+
+
+def main(args, stats=None):
+    if stats is not None:
+        with stats.phase("config"):
+            config = Config(args.instr_config, useyaml=args.use_yaml,
+                            cache=not args.no_cache)
+    else:
+        config = Config(args.instr_config, useyaml=args.use_yaml,
+                        cache=not args.no_cache)
 
     mode = "binary"
     if args.hex:
         mode = "hex"
     elif args.bin:
         mode = "binnum"
-    assembler = Assembler(config, mode, args.verbose)
+    if args.format is not None:
+        mode = args.format
+    if args.disassemble and mode not in ("binary", "hex", "binnum"):
+        sys.exit(f"-d can not read {mode} images")
+    assembler = Assembler(config, mode, args.verbose, args.endian,
+                          "numpy" if args.numpy else "python", stats)
+    assembler.diagnostics.max_errors = args.max_errors
+    if args.listing is not None or args.source_map is not None:
+        from listing import Listing
+        if (args.file_in is None or len(args.file_in) > 1 or args.parallel
+                or args.link or args.emit_obj or args.incremental):
+            sys.exit("--listing and --source-map need one -s file")
+        if args.listing is not None and args.stream:
+            sys.exit("--listing can not be used with --stream")
+        assembler.listing = Listing(args.listing, args.source_map)
 
-    if args.single is not None:
+    if args.serve or args.socket is not None:
+        from server import AsmServer
+        server = AsmServer(config, mode, args.endian)
+        if args.socket is not None:
+            server.serve_socket(args.socket)
+        else:
+            server.serve_stdio()
+    elif args.disassemble is not None:
+        from disassembler import Disassembler
+        disassembler = Disassembler(config)
+        if args.file_out is None:
+            disassembler.disassemble_file(args.disassemble, sys.stdout, mode,
+                                          args.endian, args.skip_zeros)
+        else:
+            with open(args.file_out, "w", encoding="utf-8") as fout:
+                disassembler.disassemble_file(args.disassemble, fout, mode,
+                                              args.endian, args.skip_zeros)
+    elif args.single is not None:
         assembler.convert_single(args.single)
+    elif args.file_in is not None and (args.link or args.emit_obj):
+        import os
+        from batch import expand_sources
+        from linker import link_files, load_module, save_object
+        files = expand_sources(args.file_in)
+        if args.emit_obj:
+            for file_in in files:
+                module = load_module(config, file_in, not args.no_cache)
+                save_object(module, os.path.splitext(file_in)[0] + ".o")
+        else:
+            link_files(assembler, files, args.file_out, not args.no_cache)
+    elif args.file_in is not None and args.parallel:
+        from parallel import convert_parallel
+        convert_parallel(assembler, args.file_in[0], args.file_out, args.jobs)
+    elif args.file_in is not None and (len(args.file_in) > 1
+                                       or args.jobs is not None
+                                       or args.file_in[0].startswith("@")
+                                       or has_magic(args.file_in[0])):
+        from batch import assemble_batch, expand_sources
+        if args.file_out is not None:
+            sys.exit("-o can not be used when assembling several files")
+        failures = assemble_batch(expand_sources(args.file_in), config, mode,
+                                  args.endian, args.stream, args.jobs)
+        if failures:
+            sys.exit(f"{len(failures)} file(s) failed")
+    elif args.file_in is not None and args.incremental:
+        from incremental import IncrementalAssembler
+        if args.file_out is None:
+            sys.exit("--incremental needs an output file")
+        IncrementalAssembler(assembler).convert_text_file(args.file_in[0],
+                                                          args.file_out)
+    elif args.file_in is not None and args.stream:
+        assembler.convert_text_stream(args.file_in[0], args.file_out)
     elif args.file_in is not None:
-        assembler.convert_text_file(args.file_in, args.file_out)
+        assembler.convert_text_file(args.file_in[0], args.file_out)
     else:
         print("use -h to view options")
+
+
+if __name__ == "__main__":
+    args = setup()
+    stats = None
+    if args.stats is not None:
+        from stats import Stats
+        stats = Stats()
+
+    profile = None
+    if args.profile is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    status = 0
+    try:
+        main(args, stats)
+    except AssemblyError as exc:
+        print(exc, file=sys.stderr)
+        status = 1
+    except ValueError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        status = 1
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile)
+        if stats is not None and args.stats == "json":
+            stats.write_json(sys.stderr)
+        elif stats is not None:
+            stats.write_table(sys.stderr)
+    sys.exit(status)
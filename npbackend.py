@@ -0,0 +1,183 @@
+from config import OPERAND_REG, OPERAND_BASE_REG, OPERAND_IMM
+from assembler import parse_int, split_base
+from diagnostics import SourceError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# hex digits of every byte value, used to format whole images at once
+if np is not None:
+    HEX_DIGITS = np.frombuffer(
+        "".join(f"{i:02x}" for i in range(256)).encode(), dtype=np.uint8
+    ).reshape(256, 2)
+
+
+def available():
+    return np is not None
+
+
+# encodes (address, instruction) pairs in bulk, returns the address and word
+# columns. data directives are built by the assembler and their words follow
+# the instructions
+def encode(assembler, asm_instructions):
+    data = [pair for pair in asm_instructions
+            if pair[1][0].t_type == "directive"]
+    if not data:
+        return encode_instructions(assembler, asm_instructions)
+    addresses, words = encode_instructions(
+        assembler, [pair for pair in asm_instructions
+                    if pair[1][0].t_type != "directive"])
+    address_columns = [addresses]
+    word_columns = [words]
+    for addr, instruction in data:
+        block = np.frombuffer(assembler.data(instruction, addr),
+                              dtype=np.uint32)
+        address_columns.append(np.arange(addr, addr + len(block),
+                                         dtype=np.int64))
+        word_columns.append(block)
+    return np.concatenate(address_columns), np.concatenate(word_columns)
+
+
+# instructions that share an operand layout are grouped, the operands of each
+# group are parsed into integer columns and the words are built with one
+# mask/shift/or per field. returns the address and word columns in source
+# order
+def encode_instructions(assembler, asm_instructions):
+    encoders = assembler.config.encoders
+    tags = assembler.tags
+    count = len(asm_instructions)
+    addresses = np.fromiter((addr for addr, _ in asm_instructions),
+                            dtype=np.int64, count=count)
+    instructions = [instruction for _, instruction in asm_instructions]
+    words = np.zeros(count, dtype=np.int64)
+    if count == 0:
+        return addresses, words.astype(np.uint32)
+
+    # rows of every mnemonic, then mnemonics with the same operand layout
+    # are merged into one group
+    names, name_ids = np.unique([ins[0].value for ins in instructions],
+                                return_inverse=True)
+    order = np.argsort(name_ids, kind="stable")
+    bounds = np.cumsum(np.bincount(name_ids, minlength=len(names)))[:-1]
+    groups = {}
+    fixed = np.zeros(len(names), dtype=np.int64)
+    lengths = np.zeros(len(names), dtype=np.int64)
+    for i, (name, rows) in enumerate(zip(names.tolist(),
+                                         np.split(order, bounds))):
+        if (encoder := encoders.get(name)) is None:
+            raise SourceError(f"unknown instruction {name}",
+                              instructions[rows[0]][0])
+        fixed[i] = encoder.fixed
+        lengths[i] = encoder.operands + 1
+        groups.setdefault((encoder.slots, encoder.relative), []).append(rows)
+
+    wrong = np.flatnonzero(np.fromiter(map(len, instructions), dtype=np.int64,
+                                       count=count) != lengths[name_ids])
+    if len(wrong):
+        instruction = instructions[wrong[0]]
+        operands = lengths[name_ids[wrong[0]]] - 1
+        raise SourceError(f"{instruction[0].value} takes {operands} "
+                          f"operand(s), got {len(instruction) - 1}",
+                          instruction[0])
+
+    for (slots, relative), rows in groups.items():
+        rows = np.sort(np.concatenate(rows))
+        group = fixed[name_ids[rows]]
+        row_list = rows.tolist()
+        for index, kind, shift, mask in slots:
+            # only the distinct operand texts are parsed, programs reuse the
+            # same few registers and immediates over and over
+            unique, inverse = np.unique(
+                [instructions[i][index].value for i in row_list],
+                return_inverse=True)
+            values = np.zeros(len(unique), dtype=np.int64)
+            is_tag = np.zeros(len(unique), dtype=bool)
+            for i, token in enumerate(unique.tolist()):
+                try:
+                    values[i], is_tag[i] = operand_value(
+                        kind, token, tags, assembler.expressions)
+                except SourceError as exc:
+                    row = row_list[int(np.argmax(inverse == i))]
+                    raise SourceError(str(exc), instructions[row][index])
+            column = values[inverse]
+            if relative and is_tag.any():
+                # branch targets are relative to the next instruction
+                rel = is_tag[inverse]
+                column[rel] -= addresses[rows][rel] + 1
+            check_range(column, kind, mask, relative, instructions, row_list,
+                        index)
+            group |= (column & mask) << shift
+        words[rows] = group
+    return addresses, words.astype(np.uint32)
+
+
+# same checks as Assembler.get_instr_bin, over a whole column
+def check_range(column, kind, mask, relative, instructions, row_list, index):
+    if kind == OPERAND_IMM:
+        low, high = ~(mask >> 1), mask >> 1 if relative else mask
+    else:
+        low, high = 0, mask
+    bad = np.flatnonzero((column < low) | (column > high))
+    if len(bad):
+        token = instructions[row_list[bad[0]]][index]
+        if kind == OPERAND_IMM:
+            raise SourceError(f"{token.value} ({column[bad[0]]}) does not fit "
+                              f"in {mask.bit_length()} bits", token)
+        raise SourceError(f"register {token.value} out of range "
+                          f"(r0-r{mask})", token)
+
+
+# (value, uses a label) of an operand, same rules as Assembler.get_instr_bin
+def operand_value(kind, token, tags, expressions):
+    if kind == OPERAND_REG:
+        try:
+            return int(token.lower().replace("r", "")), False
+        except ValueError:
+            raise SourceError(f"invalid register {token}") from None
+    elif kind == OPERAND_BASE_REG:
+        token = split_base(token)[1]
+        return (int(token[1:]) if token is not None else 0), False
+    token = split_base(token)[0]
+    if (target := tags.get(token)) is not None:
+        return target, True
+    if (value := parse_int(token.lower())) is not None:
+        return value, False
+    expression = expressions.parse(token)
+    if (value := expressions.evaluate(expression)) is None:
+        raise SourceError(f"undefined symbol {expressions.missing(expression)}")
+    return value, type(expression) is not int
+
+
+def write_image(addresses, words, filename, mode="binary", byteorder="big",
+                word_size=32):
+    word_bytes = word_size // 8
+    if mode == "binary":
+        dtype = np.dtype((">u" if byteorder == "big" else "<u")
+                         + str(word_bytes))
+        with open(filename, "wb") as fout:
+            # contiguous runs are written with one call, gaps become holes
+            breaks = np.flatnonzero(np.diff(addresses) != 1) + 1
+            for run in np.split(np.arange(len(addresses)), breaks):
+                if len(run):
+                    fout.seek(int(addresses[run[0]]) * word_bytes)
+                    words[run].astype(dtype).tofile(fout)
+            end = int(addresses.max()) + 1 if len(addresses) else 0
+            fout.truncate(end * word_bytes)
+        return
+
+    end = int(addresses.max()) + 1 if len(addresses) else 0
+    image = np.zeros(end, dtype=np.uint32)
+    image[addresses] = words
+    be_bytes = image.astype(f">u{word_bytes}").view(np.uint8).reshape(
+        end, word_bytes)
+    if mode == "hex":
+        text = HEX_DIGITS[be_bytes].reshape(end, 2 * word_bytes)
+    elif mode == "binnum":
+        text = np.unpackbits(be_bytes, axis=1) + ord("0")
+    else:
+        raise ValueError(f"unknown output mode {mode}")
+    newline = np.full((end, 1), ord("\n"), dtype=np.uint8)
+    with open(filename, "wb") as fout:
+        fout.write(np.hstack((text, newline)).tobytes())
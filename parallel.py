@@ -0,0 +1,162 @@
+import io
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from assembler import CONSTANTS, ORGS, Assembler, Tokenizer
+from macros import PREPROCESSOR
+from writer import FORMATS, merge_runs
+
+# per worker process state, set up once by init_worker
+worker = {}
+
+
+# splits a file into about count byte ranges that start at line boundaries
+def split_chunks(file_in, count):
+    size = os.path.getsize(file_in)
+    bounds = [0]
+    with open(file_in, "rb") as f:
+        for i in range(1, count):
+            f.seek(max(size * i // count, bounds[-1]))
+            f.readline()
+            if (pos := f.tell()) < size and pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+# lines of a chunk, split exactly like reading the file as text would
+def read_chunk(file_in, start, end):
+    with open(file_in, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data), encoding="utf-8").readlines()
+
+
+def init_worker(config, symbols=None):
+    worker["assembler"] = Assembler(config)
+    if symbols is not None:
+        worker["assembler"].tags.update(symbols)
+
+
+# first pass over a chunk: its line count, and its layout as segments
+# [org or None, instruction count] with the labels as (name, segment, offset).
+# the address a chunk starts at is only known once the chunks before it are.
+# None if the chunk uses macros, repeats or includes, their expansion
+# depends on the chunks before it (and .incbin, its path is relative to the
+# file including it, and constants, chunks see the ones before them)
+def scan_chunk(file_in, start, end):
+    assembler = worker["assembler"]
+    lines = read_chunk(file_in, start, end)
+    segments = [[None, 0]]
+    labels = []
+    tokenizer = Tokenizer(assembler.config.instr_map)
+    for instruction in tokenizer.iter_tokens(text=lines, max_tokens=2):
+        if instruction[0].t_type == "tag":
+            labels.append((instruction[0].value, len(segments) - 1,
+                           segments[-1][1]))
+            instruction = instruction[1:]
+            if not instruction:
+                continue
+
+        match instruction[0].t_type:
+            case "directive" if (instruction[0].value in PREPROCESSOR
+                                 or instruction[0].value in CONSTANTS
+                                 or instruction[0].value == ".incbin"):
+                return None
+            case "directive" if instruction[0].value in ORGS:
+                # an org at a label needs the chunks before it
+                if len(instruction) < 2 or (
+                        org := assembler.value(instruction[1].value)) is None:
+                    return None
+                segments.append([org, 0])
+            case "directive":
+                # only two tokens were read, data needs all of them
+                line = lines[instruction[0].line_num]
+                for data in tokenizer.iter_tokens(text=[line]):
+                    if data[0].t_type == "tag":
+                        data = data[1:]
+                    segments[-1][1] += assembler.data_size(data)
+            case "name":
+                segments[-1][1] += 1
+    return len(lines), segments, labels
+
+
+# second pass over a chunk with every label known, returns the words as
+# (start address, words) runs
+def encode_chunk(file_in, start, end, first_line, address):
+    assembler = worker["assembler"]
+    lines = read_chunk(file_in, start, end)
+    tokenizer = Tokenizer(assembler.config.instr_map)
+    runs = [(address, array("I"))]
+    for instruction in tokenizer.iter_tokens(text=lines,
+                                             first_line=first_line):
+        if instruction[0].t_type == "tag":
+            instruction = instruction[1:]
+            if not instruction:
+                continue
+
+        match instruction[0].t_type:
+            case "directive" if instruction[0].value in ORGS:
+                address = assembler.org(instruction)
+                runs.append((address, array("I")))
+            case "directive":
+                words = assembler.data(instruction, address)
+                runs[-1][1].extend(words)
+                address += len(words)
+            case "name":
+                runs[-1][1].append(assembler.get_instr_bin(instruction,
+                                                           address))
+                address = address + 1
+    return [run for run in runs if run[1]]
+
+
+# assembles one large file on a process pool: the chunks are scanned in
+# parallel, their layouts are merged into the label addresses, then the
+# chunks are encoded in parallel and written in order. the output is the
+# same as assembling the file in one go
+def convert_parallel(assembler, file_in, file_out, jobs=None, chunks=None):
+    jobs = jobs or os.cpu_count() or 1
+    ranges = split_chunks(file_in, chunks or jobs * 4)
+    files = [file_in] * len(ranges)
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(assembler.config,)) as pool:
+        scans = list(pool.map(scan_chunk, files, starts, ends))
+    if None in scans:
+        assembler.convert_text_file(file_in, file_out)
+        return
+
+    first_lines = []
+    chunk_addresses = []
+    line = 0
+    address = 0
+    for line_count, segments, labels in scans:
+        first_lines.append(line)
+        line += line_count
+        bases = []
+        for org, count in segments:
+            if org is not None:
+                address = org
+            bases.append(address)
+            address += count
+        chunk_addresses.append(bases[0])
+        for name, segment, offset in labels:
+            assembler.symbols.define(name, bases[segment] + offset)
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(assembler.config,
+                                       assembler.tags)) as pool:
+        results = pool.map(encode_chunk, files, starts, ends, first_lines,
+                           chunk_addresses)
+        if not file_out:
+            for _ in results:
+                pass
+            return
+        runs = (run for chunk in results for run in chunk)
+        if getattr(FORMATS.get(assembler.mode), "ordered", False):
+            runs = merge_runs(runs)
+        with assembler.open_image(file_out) as fout:
+            for start, words in runs:
+                fout.write_words(start, words)
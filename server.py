@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+from assembler import Assembler, pint
+from diagnostics import AssemblyError
+from disassembler import Disassembler
+
+HELP = ("commands: encode <instruction> | decode <word> | "
+        "assemble <file_in> [file_out] | ping | help | quit")
+
+
+# keeps the config and encoder tables loaded and answers one request per
+# line, either on stdin/stdout or on a unix socket. every reply is a single
+# line starting with "ok" or "error"
+class AsmServer:
+    config: object
+    mode: str
+    byteorder: str
+
+    def __init__(self, config, mode="binary", byteorder="big"):
+        self.config = config
+        self.mode = mode
+        self.byteorder = byteorder
+        self.assembler = Assembler(config, mode, byteorder=byteorder)
+        self.disassembler = Disassembler(config)
+
+    def handle(self, line):
+        command, _, arg = line.strip().partition(" ")
+        arg = arg.strip()
+        try:
+            match command:
+                case "encode":
+                    num = self.assembler.encode_line(arg)
+                    bits = self.config.word_size
+                    if self.mode == "binnum":
+                        return f"ok {num:#0{bits + 2}b}"
+                    return f"ok {num:#0{bits // 4 + 2}x}"
+                case "decode":
+                    text = self.disassembler.decode(pint(arg.lower()))
+                    if text is None:
+                        return "error no instruction matches"
+                    return "ok " + text
+                case "assemble":
+                    file_in, _, file_out = arg.partition(" ")
+                    assembler = Assembler(self.config, self.mode,
+                                          byteorder=self.byteorder)
+                    assembler.convert_text_file(file_in, file_out.strip())
+                    return "ok"
+                case "ping":
+                    return "ok pong"
+                case "help":
+                    return "ok " + HELP
+                case "":
+                    return "error empty request"
+                case _:
+                    return f"error unknown command {command}"
+        except AssemblyError as exc:
+            # replies are one line
+            return "error " + "; ".join(map(str, exc.diagnostics))
+        except Exception as exc:
+            return f"error {type(exc).__name__}: {exc}"
+
+    def serve_stdio(self, fin=sys.stdin, fout=sys.stdout):
+        for line in fin:
+            if line.strip() == "quit":
+                break
+            fout.write(self.handle(line) + "\n")
+            fout.flush()
+
+    def serve_socket(self, path):
+        asyncio.run(self.run_socket(path))
+
+    async def run_socket(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.client, path)
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                os.remove(path)
+
+    async def client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                request = line.decode("utf-8", "replace")
+                if request.strip() == "quit":
+                    break
+                writer.write((self.handle(request) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
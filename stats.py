@@ -0,0 +1,65 @@
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# wall time and memory high-water mark per phase, and counters (lines,
+# tokens, instructions, ...). everything that takes a stats object does
+# nothing extra when it is None
+class Stats:
+    phases: dict  # name -> [seconds, peak rss in kb after the phase]
+    counts: dict
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            phase = self.phases.setdefault(name, [0.0, None])
+            phase[0] += elapsed
+            phase[1] = peak_rss_kb()
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def to_dict(self):
+        return {
+            "phases": {name: {"seconds": round(seconds, 6),
+                              "peak_rss_kb": rss}
+                       for name, (seconds, rss) in self.phases.items()},
+            "counts": dict(self.counts),
+            "total_seconds": round(sum(p[0] for p in self.phases.values()),
+                                   6),
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+    def write_json(self, fout):
+        fout.write(json.dumps(self.to_dict()) + "\n")
+
+    def write_table(self, fout):
+        lines = [f"{'phase':<12} {'seconds':>10} {'peak rss':>12}\n"]
+        for name, (seconds, rss) in self.phases.items():
+            rss = f"{rss / 1024:.1f} MiB" if rss is not None else "-"
+            lines.append(f"{name:<12} {seconds:>10.4f} {rss:>12}\n")
+        total = sum(p[0] for p in self.phases.values())
+        lines.append(f"{'total':<12} {total:>10.4f}\n")
+        for name, value in self.counts.items():
+            lines.append(f"{name:<12} {value:>10}\n")
+        fout.writelines(lines)
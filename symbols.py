@@ -0,0 +1,65 @@
+# whether value fits a field of mask as a signed or an unsigned number,
+# relative offsets can only be signed
+def fits(value, mask, relative=False):
+    return ~(mask >> 1) <= value <= (mask >> 1 if relative else mask)
+
+
+class Fixup:
+    __slots__ = ("handle", "address", "shift", "mask", "relative",
+                 "expression", "source")
+
+    # handle is whatever the output returned when the word was written.
+    # expression is None when the reference is a bare label, source is the
+    # (file, line, col) of the reference for errors
+    def __init__(self, handle, address, shift, mask, relative,
+                 expression=None, source=None):
+        self.handle = handle
+        self.address = address
+        self.shift = shift
+        self.mask = mask
+        self.relative = relative
+        self.expression = expression
+        self.source = source
+
+    # the operand once the symbol is at target
+    def value(self, target):
+        return target - (self.address + 1) if self.relative else target
+
+    # bits to or into the word once the symbol is at target
+    def bits(self, target):
+        return (self.value(target) & self.mask) << self.shift
+
+    def __repr__(self):
+        return (f"Fixup({self.handle}, {self.address}, {self.shift}, "
+                f"{self.mask}, {self.relative})")
+
+
+# labels and their addresses. references to labels that are not defined yet
+# are kept as fixups until the label shows up, so a program can be assembled
+# in a single pass and only the unresolved references stay in memory
+class SymbolTable:
+    symbols: dict  # name -> address
+    pending: dict  # name -> [Fixup] waiting for the name to be defined
+
+    def __init__(self):
+        self.symbols = {}
+        self.pending = {}
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def get(self, name, default=None):
+        return self.symbols.get(name, default)
+
+    # defines a label, returns the fixups that can now be patched
+    def define(self, name, address):
+        if name in self.symbols:
+            raise ValueError(f"symbol {name} defined twice")
+        self.symbols[name] = address
+        return self.pending.pop(name, ())
+
+    def reference(self, name, fixup):
+        self.pending.setdefault(name, []).append(fixup)
+
+    def unresolved(self):
+        return list(self.pending)
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import assemble  # noqa: E402
+
+CLI = os.path.join(ROOT, "minisrc-asm.py")
+SOURCE = os.path.join(ROOT, "tests", "instructions.s")
+
+MODES = {"": "bin", "-x": "hex", "-b": "binnum"}
+
+FORWARD = """\
+ORG 0
+    ldi r1, 2
+    brzr r1, done
+    ldi r2, end
+loop: brnz r1, loop
+done: addi r1, r1, -1
+    brnz r1, loop
+end: halt
+"""
+
+
+def run(*args):
+    return subprocess.run([sys.executable, CLI, *args], capture_output=True,
+                          text=True)
+
+
+def golden(ext):
+    with open(os.path.join(ROOT, "tests", f"instructions.{ext}"), "rb") as f:
+        return f.read()
+
+
+# every way of assembling a file writes the same image
+@pytest.mark.parametrize("flags", [
+    [], ["--stream"], ["--numpy"], ["--parallel"], ["--link", "--no-cache"],
+])
+@pytest.mark.parametrize("mode", MODES)
+def test_golden_files(tmp_path, mode, flags):
+    if "--numpy" in flags:
+        pytest.importorskip("numpy")
+    out = tmp_path / f"out.{MODES[mode]}"
+    args = ["-s", SOURCE, "-o", str(out), *flags]
+    if mode:
+        args.append(mode)
+    result = run(*args)
+    assert result.returncode == 0, result.stderr
+    assert out.read_bytes() == golden(MODES[mode])
+
+
+# --stream writes the branch before it knows where done: and end: are and
+# patches the words in the file when they are defined
+@pytest.mark.parametrize("mode", MODES)
+def test_stream_forward_reference(tmp_path, mode):
+    source = tmp_path / "forward.s"
+    source.write_text(FORWARD)
+    streamed = tmp_path / f"streamed.{MODES[mode]}"
+    written = tmp_path / f"written.{MODES[mode]}"
+    for out, flags in ((streamed, ["--stream"]), (written, [])):
+        args = ["-s", str(source), "-o", str(out), *flags]
+        if mode:
+            args.append(mode)
+        result = run(*args)
+        assert result.returncode == 0, result.stderr
+    assert streamed.read_bytes() == written.read_bytes()
+
+    image = assemble(FORWARD)
+    if not mode:
+        assert streamed.read_bytes() == b"".join(
+            word.to_bytes(4, "big") for word in image)
+
+
+def test_label_errors(tmp_path):
+    source = tmp_path / "labels.s"
+    source.write_text("x: nop\nbrzr r1, nowhere\nx: nop\n")
+    out = tmp_path / "labels.bin"
+    result = run("-s", str(source), "-o", str(out))
+    assert result.returncode != 0
+    assert f"{source}:3:1: error: symbol x defined twice" in result.stderr
+    assert (f"{source}:2:10: error: undefined symbol nowhere"
+            in result.stderr)
+    # nothing is written when there is an error
+    assert not out.exists()
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import assemble  # noqa: E402
+from config import Config  # noqa: E402
+from diagnostics import AssemblyError  # noqa: E402
+
+
+# the built-in config cut down to 16 bit instructions
+def config_16(tmp_path):
+    with open(os.path.join(ROOT, "configs", "default.json")) as f:
+        data = json.load(f)
+    data["word_size"] = 16
+    data["formats"] = [
+        {"name": "R", "fields": [
+            {"name": "opcode", "msb": 15, "lsb": 11},
+            {"name": "Ra", "msb": 10, "lsb": 8},
+            {"name": "Rb", "msb": 7, "lsb": 5},
+            {"name": "Rc", "msb": 4, "lsb": 2}]},
+        {"name": "M", "fields": [{"name": "opcode", "msb": 15, "lsb": 11}]}]
+    data["instructions"] = [
+        {"name": "add", "opcode": 3, "format": "R",
+         "textformat": "arithmetic"},
+        {"name": "nop", "opcode": 26, "format": "M", "textformat": "misc"}]
+    path = tmp_path / "config16.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_data_words():
+    image = assemble([".word -1, 0x12345678", ".db 1, 2, 3, -1",
+                      ".fill 2, 7", ".space 1"])
+    assert list(image) == [0xffffffff, 0x12345678, 0x010203ff, 7, 7, 0]
+
+
+@pytest.mark.parametrize("line, message", [
+    (".word 1<<40", "1<<40 (1099511627776) does not fit in 32 bits"),
+    (".db 1, 256", "256 (256) does not fit in 8 bits"),
+    (".fill 2, 1<<33", "1<<33 (8589934592) does not fit in 32 bits"),
+])
+def test_data_does_not_fit(line, message):
+    with pytest.raises(AssemblyError) as exc:
+        assemble([line])
+    assert exc.value.diagnostics[0].message == message
+
+
+def test_example_config_word_size():
+    assert Config(os.path.join(ROOT, "examples", "example.json"),
+                  cache=False).word_size == 32
+
+
+# every output writes words of the config's size
+def test_word_size_16(tmp_path):
+    config = config_16(tmp_path)
+    source = tmp_path / "prog.s"
+    source.write_text("add r1, r2, r3\nnop\n.db 1, 2, 3\nORG 6\n.word -1\n")
+    outputs = {}
+    for flags, name in (([], "prog.bin"), (["-x"], "prog.hex"),
+                        (["-b"], "prog.binnum"), (["-f", "mif"], "prog.mif")):
+        out = tmp_path / name
+        subprocess.run([sys.executable, os.path.join(ROOT, "minisrc-asm.py"),
+                        "--no-cache", "-c", config, "-s", str(source),
+                        "-o", str(out)] + flags, check=True,
+                       stdout=subprocess.DEVNULL)
+        outputs[name] = out.read_bytes()
+    assert outputs["prog.bin"] == bytes.fromhex(
+        "194c d000 0102 0300 0000 0000 ffff")
+    assert outputs["prog.hex"].split() == [
+        b"194c", b"d000", b"0102", b"0300", b"0000", b"0000", b"ffff"]
+    assert outputs["prog.binnum"].split()[0] == b"0001100101001100"
+    assert b"WIDTH=16;" in outputs["prog.mif"]
+    assert b"\t6 : ffff;" in outputs["prog.mif"]
+
+    listing = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "minisrc-asm.py"), "--no-cache",
+         "-c", config, "-d", str(tmp_path / "prog.bin")],
+        check=True, capture_output=True, text=True).stdout
+    assert listing.splitlines()[0] == "0x00000000: 194c  add r1, r2, r3"
@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import assemble  # noqa: E402
+from config import Config  # noqa: E402
+from diagnostics import AssemblyError  # noqa: E402
+from linker import compile_module, link  # noqa: E402
+
+
+# (file, line, col) of the only error, counted from 1 like the output
+def error_at(source, file_name="test.s"):
+    with pytest.raises(AssemblyError) as info:
+        assemble(source, file_name=file_name)
+    diagnostic, = info.value.diagnostics
+    where = diagnostic.to_dict()
+    return where["file"], where["line"], where["col"], where["message"]
+
+
+@pytest.mark.parametrize("source, line, col, message", [
+    ("nop\nORG\n", 2, 1, "ORG without an address"),
+    ("nop\nORG x\n", 2, 5, "Invalid org value"),
+    ("nop\n.rept x\nnop\n.endr\n", 2, 7, "invalid .rept count"),
+    ("nop\n.rept 2\nnop\n", 2, 1, "missing .endr"),
+    ("nop\n.endm\n", 2, 1, ".endm without a block to end"),
+    (".macro\n", 1, 1, ".macro without a name"),
+    (".macro m a\nnop\n.endm\nnop\n  m 1, 2\n", 5, 3,
+     "too many arguments for macro m"),
+    ("nop\n.include\n", 2, 1, ".include without a file"),
+    ("nop\nldi r1, 1+\n", 2, 9, "invalid expression 1+"),
+    ("nop\nbrzr r1, nowhere\n", 2, 10, "undefined symbol nowhere"),
+    ("x: nop\nx: nop\n", 2, 1, "symbol x defined twice"),
+])
+def test_error_location(source, line, col, message):
+    assert error_at(source) == ("test.s", line, col, message)
+
+
+def test_missing_files(tmp_path):
+    file_name = str(tmp_path / "test.s")
+    _, line, col, message = error_at('nop\n.incbin "missing.bin"\n',
+                                     file_name)
+    assert (line, col) == (2, 9)
+    assert message.startswith("can not read")
+    _, line, col, message = error_at('nop\n.include "missing.s"\n', file_name)
+    assert (line, col) == (2, 10)
+    assert message.startswith("can not read")
+
+
+# the error is reported in the included file, not the one including it
+def test_error_in_include(tmp_path):
+    (tmp_path / "inc.s").write_text("nop\n.endr\n")
+    file_name = str(tmp_path / "test.s")
+    where = error_at('nop\nnop\n.include "inc.s"\n', file_name)
+    assert where == (str(tmp_path / "inc.s"), 2, 1,
+                     ".endr without a block to end")
+
+
+def test_include_cycle(tmp_path):
+    (tmp_path / "a.s").write_text('nop\n.include "b.s"\n')
+    (tmp_path / "b.s").write_text('.include "a.s"\n')
+    file_name, line, col, message = error_at(
+        '.include "a.s"\n', str(tmp_path / "test.s"))
+    assert (file_name, line, col) == (str(tmp_path / "b.s"), 1, 10)
+    assert message.endswith("includes itself")
+
+
+def test_link_errors(tmp_path):
+    config = Config()
+    (tmp_path / "a.s").write_text(".global x\nx: nop\nbrzr r1, y\n")
+    (tmp_path / "b.s").write_text(".global x\nx: nop\n")
+    modules = [compile_module(config, str(tmp_path / name))
+               for name in ("a.s", "b.s")]
+    with pytest.raises(AssemblyError) as info:
+        link(modules)
+    assert sorted(str(d) for d in info.value.diagnostics) == [
+        "a.s: error: undefined symbol y",
+        "b.s: error: symbol x exported by more than one module"]
+
+    (tmp_path / "d.s").write_text("nop\n.global x, y\nx: nop\n")
+    with pytest.raises(AssemblyError) as info:
+        compile_module(config, str(tmp_path / "d.s"))
+    assert [str(d) for d in info.value.diagnostics] == [
+        f"{tmp_path / 'd.s'}:2:12: error: exported label y is not defined"]
+
+    (tmp_path / "c.s").write_text("nop\nORG\n")
+    with pytest.raises(AssemblyError) as info:
+        compile_module(config, str(tmp_path / "c.s"))
+    assert [str(d) for d in info.value.diagnostics] == [
+        f"{tmp_path / 'c.s'}:2:1: error: ORG without an address"]
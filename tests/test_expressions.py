@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import assemble, encode  # noqa: E402
+from expressions import Evaluator, Expression  # noqa: E402
+
+
+@pytest.mark.parametrize("text, value", [
+    ("1+2*3", 7),
+    ("(1+2)*3", 9),
+    ("10-4-3", 3),
+    ("1<<2+1", 8),
+    ("16>>2>>1", 2),
+    ("6&3|8", 10),
+    ("8|6&3", 10),
+    ("-2*3", -6),
+    ("~0&0xf", 15),
+    ("-(1+2)", -3),
+    ("0b101+0x10", 21),
+])
+def test_precedence(text, value):
+    assert Evaluator().parse(text) == value
+
+
+@pytest.mark.parametrize("text", ["1+", "(1+2", "1 + 2", "*3", "1$"])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        Evaluator().parse(text)
+
+
+# constants are folded while parsing, only the labels are left
+def test_constant_folding():
+    evaluator = Evaluator()
+    evaluator.define("SIZE", "4")
+    assert evaluator.parse("SIZE*2+1") == 9
+    expression = evaluator.parse("table+SIZE*2")
+    assert isinstance(expression, Expression)
+    assert expression.names == ("table",)
+    assert evaluator.residual(expression) == "(table+8)"
+    assert evaluator.evaluate(expression) is None
+    evaluator.symbols["table"] = 0x100
+    assert evaluator.evaluate(expression) == 0x108
+
+
+# expressions were folded with the old value, a .set that changes it starts
+# the parse cache over
+def test_set_clears_parse_cache():
+    evaluator = Evaluator()
+    evaluator.define("N", "1")
+    assert evaluator.parse("N+1") == 2
+    evaluator.define("N", "1", redefine=True)
+    assert "N+1" in evaluator.cache
+    evaluator.define("N", "2", redefine=True)
+    assert "N+1" not in evaluator.cache
+    assert evaluator.parse("N+1") == 3
+    with pytest.raises(ValueError):
+        evaluator.define("N", "3")
+
+
+# the same line before and after a .set is encoded again, not taken from
+# the memo of encoded lines
+def test_set_clears_memo():
+    image = assemble(".set N, 1\nldi r1, N\nldi r1, N+1\n"
+                     ".set N, 2\nldi r1, N\nldi r1, N+1\n")
+    assert list(image) == [encode("ldi r1, 1"), encode("ldi r1, 2"),
+                           encode("ldi r1, 2"), encode("ldi r1, 3")]
+    assert image.constants == {"N": 2}
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("ldi r1, end-start", "ldi r1, 2"),
+    ("ldi r1, end-start(r2)", "ldi r1, 2(r2)"),
+    ("ldi r1, (end+start)*2", "ldi r1, 8"),
+    ("ldi r1, end+SIZE", "ldi r1, 7"),
+    # relative to the next instruction, like a label
+    ("brzr r1, end+1", "brzr r1, 3"),
+    ("brzr r1, start", "brzr r1, 0"),
+])
+def test_forward_label_arithmetic(line, expected):
+    image = assemble(f".equ SIZE, 4\n{line}\nstart: nop\nnop\nend: halt\n")
+    assert image[0] == encode(expected)
+    assert image.symbols == {"start": 1, "end": 3}
@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assembler import assemble, encode  # noqa: E402
+
+
+def test_image_in_address_order():
+    image = assemble(["start: ldi r1, 1", "nop", "brzr r1, start"])
+    assert image.starts == [(0, 0)]
+    assert image[0] == encode("ldi r1, 1")
+    assert image[3] == 0
+
+
+# an ORG going back puts the runs out of source order
+def test_image_backwards_org():
+    image = assemble(["ORG 4", "ldi r1, 1", "ORG 0", "nop"])
+    assert image.starts == [(0, 0), (4, 1)]
+    assert image[4] == encode("ldi r1, 1")
+    assert image[0] == encode("nop")
+    assert image[2] == 0
+    assert [(address, list(words)) for address, words in image.runs()] == [
+        (0, [encode("nop")]), (4, [encode("ldi r1, 1")])]
+
+
+# a word written twice keeps the later one, like in the image files
+def test_image_overlapping_org():
+    image = assemble(["nop", "nop", "ORG 0", "halt"])
+    assert image.starts == [(0, 0)]
+    assert list(image) == [encode("halt"), encode("nop")]
+    assert image[1] == encode("nop")
+
+    image = assemble(["ORG 4", "nop", "nop", "ORG 3", "halt", "halt"])
+    assert image.starts == [(3, 0)]
+    assert list(image) == [encode("halt"), encode("halt"), encode("nop")]
+    assert image[4] == encode("halt")
+    assert image[5] == encode("nop")
+
+
+def test_image_iterates_words():
+    image = assemble(["ORG 2", "nop", "ORG 8", "halt"])
+    assert list(image) == [encode("nop"), encode("halt")]
+    assert len(image) == 2
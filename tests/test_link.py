@@ -0,0 +1,79 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import assemble  # noqa: E402
+from config import Config  # noqa: E402
+from linker import ObjectModule, compile_module, link  # noqa: E402
+
+MAIN = """\
+.global start
+.macro spin
+wait\\@: brzr r1, wait\\@
+.endm
+start: ldi r1, 2
+loop: brzr r1, loop
+spin
+brnz r1, helper
+"""
+
+LIB = """\
+.global helper
+.macro spin
+wait\\@: brzr r1, wait\\@
+.endm
+helper: nop
+loop: brzr r1, loop
+spin
+brzr r1, start
+"""
+
+
+def link_sources(tmp_path, sources):
+    modules = []
+    for i, source in enumerate(sources):
+        path = tmp_path / f"m{i}.s"
+        path.write_text(source)
+        modules.append(compile_module(Config(), str(path)))
+    return link(modules)
+
+
+# loop: and the wait1: from spin are in both modules, each module uses its
+# own. linked, the words are the same as the files assembled together with
+# the local labels renamed
+def test_labels_are_local(tmp_path):
+    lines, symbols = link_sources(tmp_path, [MAIN, LIB])
+    assert symbols == {"start": 0, "helper": 4}
+    image = assemble("""\
+start: ldi r1, 2
+loop: brzr r1, loop
+wait1: brzr r1, wait1
+brnz r1, helper
+helper: nop
+loop2: brzr r1, loop2
+wait2: brzr r1, wait2
+brzr r1, start
+""")
+    assert [word for _, word in lines] == list(image)
+
+
+def test_exports_survive_objects(tmp_path):
+    path = tmp_path / "lib.s"
+    path.write_text(LIB)
+    module = compile_module(Config(), str(path))
+    assert module.exports == ["helper"]
+    copy = ObjectModule.from_json(module.to_json())
+    assert copy.exports == ["helper"]
+    assert copy.symbols == module.symbols
+
+
+# objects written before .global export every label
+def test_old_objects_export_everything(tmp_path):
+    path = tmp_path / "lib.s"
+    path.write_text(LIB)
+    text = compile_module(Config(), str(path)).to_json()
+    text = text.replace('"revision": 2, ', "")
+    module = ObjectModule.from_json(text)
+    assert sorted(module.exports) == sorted(module.symbols)
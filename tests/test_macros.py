@@ -0,0 +1,105 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import Assembler, Tokenizer, assemble, encode  # noqa: E402
+from config import Config  # noqa: E402
+from diagnostics import AssemblyError  # noqa: E402
+
+INC = ".macro inc reg, step=1\naddi reg, reg, step\n.endm\n"
+
+
+def words(lines):
+    return [encode(line) for line in lines]
+
+
+# the expanded lines, as their token values, and the preprocessor that
+# expanded them
+def expand(source, file_name=None):
+    config = Config()
+    assembler = Assembler(config)
+    tokenizer = Tokenizer(config.instr_map)
+    lines = list(assembler.preprocess(
+        tokenizer, tokenizer.iter_tokens(text=source), file_name))
+    return [" ".join(token.value for token in line) for line in lines], \
+        assembler.preprocessor
+
+
+def test_defaults():
+    image = assemble(INC + "inc r2\ninc r2, 5\ninc r3, -1\n")
+    assert list(image) == words(["addi r2, r2, 1", "addi r2, r2, 5",
+                                 "addi r3, r3, -1"])
+    with pytest.raises(AssemblyError, match="missing argument"):
+        assemble(INC + "inc\n")
+
+
+def test_parameter_inside_word():
+    image = assemble(".macro load reg, off\nld reg, \\off(r3)\n.endm\n"
+                     "load r1, 4\nload r2, -8\n")
+    assert list(image) == words(["ld r1, 4(r3)", "ld r2, -8(r3)"])
+
+
+# \@ labels do not clash between expansions, even with the same arguments
+# or inside a repeat, and are the same within one expansion
+def test_unique_labels():
+    source = (".macro wait reg\nloop\\@: brzr reg, loop\\@\n.endm\n"
+              "wait r1\nwait r1\n.rept 2\nwait r2\n.endr\n")
+    lines, _ = expand(source)
+    assert lines == ["loop1 brzr r1 loop1", "loop2 brzr r1 loop2",
+                     "loop3 brzr r2 loop3", "loop4 brzr r2 loop4"]
+    image = assemble(source)
+    assert image.symbols == {"loop1": 0, "loop2": 1, "loop3": 2, "loop4": 3}
+    assert list(image) == words(["brzr r1, -1"] * 2 + ["brzr r2, -1"] * 2)
+
+
+def test_rept_inside_macro():
+    image = assemble(".macro fill n, value\n.rept n\nldi r1, value\n.endr\n"
+                     "nop\n.endm\nfill 3, 7\nfill 1, 2\n")
+    assert list(image) == words(["ldi r1, 7"] * 3 + ["nop", "ldi r1, 2",
+                                                     "nop"])
+
+
+def test_nested_rept_and_macros():
+    image = assemble(INC + ".macro twice reg\n.rept 2\ninc reg, 2\n.endr\n"
+                     ".endm\n.rept 2\ntwice r4\n.endr\n")
+    assert list(image) == words(["addi r4, r4, 2"] * 4)
+
+
+# expansions are cached by arguments. a macro defined later can change what
+# a cached expansion expands to, so defining one drops the caches
+def test_define_clears_cache():
+    source = (".macro step value\nldi r1, value\nnop\n.endm\n"
+              "step 1\nstep 1\n"
+              ".macro nop\naddi r1, r1, 1\n.endm\nstep 1\n")
+    lines, preprocessor = expand(source)
+    assert lines == ["ldi r1 1", "nop"] * 2 + ["ldi r1 1", "addi r1 r1 1"]
+    assert list(preprocessor.macros["step"].cache) == [("1",)]
+    assert list(preprocessor.macros["nop"].cache) == [()]
+
+
+def test_unique_macros_are_not_cached():
+    _, preprocessor = expand(".macro here\nat\\@: nop\n.endm\nhere\nhere\n")
+    assert preprocessor.macros["here"].cache == {}
+
+
+def test_include_cycles(tmp_path):
+    (tmp_path / "self.s").write_text('nop\n.include "self.s"\n')
+    (tmp_path / "a.s").write_text('.include "b.s"\n')
+    (tmp_path / "b.s").write_text('nop\n.include "a.s"\n')
+    for name in ("self.s", "a.s"):
+        with pytest.raises(AssemblyError, match="includes itself"):
+            assemble(f'.include "{name}"\n',
+                     file_name=str(tmp_path / "main.s"))
+
+    # a file included twice, but not from itself, is not a cycle
+    (tmp_path / "inc.s").write_text(INC)
+    (tmp_path / "one.s").write_text("inc r1\n")
+    (tmp_path / "main.s").write_text(
+        '.include "inc.s"\n.include "one.s"\n.include "one.s"\n')
+    with open(tmp_path / "main.s") as f:
+        image = assemble(f.read(), file_name=str(tmp_path / "main.s"))
+    assert list(image) == words(["addi r1, r1, 1"] * 2)
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler import encode  # noqa: E402
+from bench import LAZY_MODULES, import_times  # noqa: E402
+from config import Config  # noqa: E402
+
+CLI = os.path.join(ROOT, "minisrc-asm.py")
+
+
+# the harnesses that run the cli for every instruction pay for each import,
+# -l with the built-in config only needs the frozen tables
+def test_single_instruction_imports():
+    _, modules = import_times([CLI, "-l", "ldi r4, 0x87(r3)"])
+    assert "assembler" in modules
+    assert [name for name in LAZY_MODULES if name in modules] == []
+
+
+def test_single_instruction_output():
+    out = subprocess.run([sys.executable, CLI, "-l", "ldi r4, 0x87(r3)"],
+                         check=True, capture_output=True, text=True).stdout
+    assert f"{encode('ldi r4, 0x87(r3)'):08x}" in out.lower()
+
+
+# configs/frozen.py is regenerated with python3 config.py --freeze
+def test_frozen_tables_up_to_date():
+    assert Config().freeze() == Config(frozen=False).freeze()
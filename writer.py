@@ -0,0 +1,455 @@
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+# how many words are buffered before they are written out
+CHUNK_WORDS = 1 << 16
+
+# array type of a word of each size in bytes
+TYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+# packs bytes into words of word_bytes bytes, the first byte is the most
+# significant and the last word is padded with zeros
+def words_from_bytes(data, word_bytes=4):
+    if (pad := -len(data) % word_bytes):
+        data = bytes(data) + bytes(pad)
+    words = array(TYPECODES[word_bytes])
+    words.frombytes(data)
+    if word_bytes > 1 and sys.byteorder == "little":
+        words.byteswap()
+    return words if word_bytes == 4 else array("I", words)
+
+
+class ImageWriter:
+    mode: str  # can be binary, binnum, hex
+    byteorder: str  # byte order of the words in binary mode
+    word_bytes: int  # bytes of a word in binary mode
+    start: int  # address of the first buffered word
+    end: int  # one past the highest address in the file
+    padding: int  # words in gaps between the written words
+
+    # patch opens an existing image and only overwrites the written words
+    def __init__(self, filename, mode="binary", byteorder="big", patch=False,
+                 word_size=32):
+        self.mode = mode
+        self.byteorder = byteorder
+        self.word_bytes = word_size // 8
+        self.buf = array("I")
+        self.start = 0
+        self.padding = 0
+        if mode == "binary":
+            self.width = self.word_bytes
+        elif mode == "binnum":
+            self.width = word_size + 1
+            self.base = 2
+            self.line = f"{{:0{word_size}b}}\n".format
+        elif mode == "hex":
+            self.width = word_size // 4 + 1
+            self.base = 16
+            self.line = f"{{:0{word_size // 4}x}}\n".format
+        else:
+            raise ValueError(f"unknown output mode {mode}")
+        self.fout = open(filename, "r+b" if patch else "w+b")
+        self.end = self.fout.seek(0, 2) // self.width
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # returns the address as the handle to patch the word with
+    def write(self, address, word):
+        if (address != self.start + len(self.buf)
+                or len(self.buf) >= CHUNK_WORDS):
+            self.flush()
+            self.start = address
+        self.buf.append(word)
+        return address
+
+    # ors bits into a word that was already written
+    def patch(self, address, bits):
+        index = address - self.start
+        if 0 <= index < len(self.buf):
+            self.buf[index] |= bits
+            return
+        self.fout.seek(address * self.width)
+        data = self.fout.read(self.width)
+        self.fout.seek(address * self.width)
+        if self.mode == "binary":
+            word = int.from_bytes(data, self.byteorder) | bits
+            self.fout.write(word.to_bytes(self.word_bytes, self.byteorder))
+        else:
+            word = int(data, self.base) | bits
+            self.fout.write(self.line(word).encode("ascii"))
+
+    # writes a run of words at once, the handle of words[i] is the returned
+    # handle + i
+    def write_words(self, address, words):
+        self.flush()
+        for i in range(0, len(words), CHUNK_WORDS):
+            self.start = address + i
+            # a copy, flushing byteswaps the buffer in place
+            self.buf = words[i:i + CHUNK_WORDS]
+            self.flush()
+        self.start = address + len(words)
+        return address
+
+    def flush(self):
+        if not self.buf:
+            return
+        start = self.start
+        if start > self.end:
+            self.padding += start - self.end
+        if self.mode == "binary":
+            # skipped words become a hole in the file instead of zeros
+            self.fout.seek(start * self.width)
+            words = self.buf
+            if self.word_bytes != 4:
+                words = array(TYPECODES[self.word_bytes], words)
+            if self.word_bytes > 1 and self.byteorder != sys.byteorder:
+                words.byteswap()
+            self.fout.write(words.tobytes())
+        else:
+            if start > self.end:
+                self.fout.seek(self.end * self.width)
+                self.write_zeros(start - self.end)
+            else:
+                # every line has the same width so earlier lines can be
+                # rewritten in place
+                self.fout.seek(start * self.width)
+            if self.mode == "hex" and self.word_bytes == 4:
+                # one word per line, straight from the big endian bytes
+                if sys.byteorder == "little":
+                    self.buf.byteswap()
+                text = self.buf.tobytes().hex("\n", 4) + "\n"
+            else:
+                text = "".join(map(self.line, self.buf))
+            self.fout.write(text.encode("ascii"))
+        self.end = max(self.end, start + len(self.buf))
+        self.start = start + len(self.buf)
+        self.buf = array("I")
+
+    def write_zeros(self, count):
+        zeros = self.line(0).encode("ascii")
+        while count > 0:
+            n = min(count, CHUNK_WORDS)
+            self.fout.write(zeros * n)
+            count -= n
+
+    def close(self):
+        self.flush()
+        if self.mode == "binary":
+            self.fout.truncate(self.end * self.width)
+        self.fout.close()
+
+
+# text images made of records that carry their address, so a gap between
+# ORG regions costs one record instead of a line per missing word. they are
+# written front to back and can not be patched, the assembler only uses them
+# once every word is known
+class RecordWriter:
+    extension: str  # for batch outputs
+    # the words are sorted by address and overlaps merged before writing
+    ordered = True
+    word_size: int
+    byteorder: str  # byte order of the words, for formats of bytes
+    start: int  # address of the first buffered word
+    end: int  # one past the highest address written
+    padding: int  # words in gaps between the written words
+
+    def __init__(self, filename, word_size=32, byteorder="big"):
+        self.word_size = word_size
+        self.digits = word_size // 4
+        self.byteorder = byteorder
+        self.buf = array("I")
+        self.start = 0
+        self.end = 0
+        self.padding = 0
+        self.fout = open(filename, "w+", encoding="ascii", newline="\n")
+        self.fout.write(self.header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # runs are cut where the address is a multiple of CHUNK_WORDS, so the
+    # records are the same however the words come in
+    def write(self, address, word):
+        if address != self.start + len(self.buf):
+            self.flush()
+            self.start = address
+        self.buf.append(word)
+        if not (address + 1) % CHUNK_WORDS:
+            self.flush()
+        return address
+
+    def write_words(self, address, words):
+        if address != self.start + len(self.buf):
+            self.flush()
+            self.start = address
+        i = 0
+        while i < len(words):
+            boundary = ((address + i) // CHUNK_WORDS + 1) * CHUNK_WORDS
+            j = min(len(words), boundary - address)
+            self.buf.extend(words[i:j])
+            if address + j == boundary:
+                self.flush()
+            i = j
+        return address
+
+    def patch(self, address, bits):
+        raise ValueError(f"{self.extension} images can not be patched")
+
+    def flush(self):
+        if not self.buf:
+            return
+        if self.start > self.end:
+            self.padding += self.start - self.end
+        self.fout.write(self.records(self.start, self.buf))
+        self.end = max(self.end, self.start + len(self.buf))
+        self.start += len(self.buf)
+        self.buf = array("I")
+
+    # hex digits of the words, one per line
+    def hex_lines(self, words):
+        if self.word_size == 32:
+            words = array("I", words)
+            if sys.byteorder == "little":
+                words.byteswap()
+            return words.tobytes().hex("\n", 4) + "\n"
+        return "".join(map(f"{{:0{self.digits}x}}\n".format, words))
+
+    def header(self):
+        return ""
+
+    def records(self, address, words):
+        raise NotImplementedError
+
+    def footer(self):
+        return ""
+
+    def close(self):
+        self.flush()
+        self.fout.write(self.footer())
+        self.fout.close()
+
+
+# verilog $readmemh, @address (in words) before every run
+class ReadmemhWriter(RecordWriter):
+    extension = ".mem"
+
+    def __init__(self, filename, word_size=32, byteorder="big"):
+        self.next = None
+        super().__init__(filename, word_size, byteorder)
+
+    def records(self, address, words):
+        text = self.hex_lines(words)
+        if address != self.next:
+            text = f"@{address:x}\n" + text
+        self.next = address + len(words)
+        return text
+
+
+# intel hex, 16 data bytes per record with extended linear address records
+# when the upper half of the byte address changes. words are bytes
+# (word_size / 8 each) at the word address times the word size
+class IntelHexWriter(RecordWriter):
+    extension = ".ihx"
+
+    def __init__(self, filename, word_size=32, byteorder="big"):
+        self.upper = 0
+        super().__init__(filename, word_size, byteorder)
+
+    def records(self, address, words):
+        word_bytes = self.word_size // 8
+        data = array(TYPECODES[word_bytes], words)
+        if word_bytes > 1 and self.byteorder != sys.byteorder:
+            data.byteswap()
+        data = data.tobytes()
+        offset = address * word_bytes
+        lines = []
+        pos = 0
+        while pos < len(data):
+            byte_address = offset + pos
+            if byte_address >> 16 != self.upper:
+                self.upper = byte_address >> 16
+                lines.append(self.record(0, 4, self.upper.to_bytes(2, "big")))
+            low = byte_address & 0xFFFF
+            # a record does not cross into the next 64k
+            n = min(16, len(data) - pos, 0x10000 - low)
+            lines.append(self.record(low, 0, data[pos:pos + n]))
+            pos += n
+        return "".join(lines)
+
+    @staticmethod
+    def record(address, kind, data):
+        record = bytes((len(data), address >> 8, address & 0xFF, kind)) + data
+        return f":{record.hex().upper()}{-sum(record) & 0xFF:02X}\n"
+
+    def footer(self):
+        return ":00000001FF\n"
+
+
+# quartus memory initialization file. gaps are one [from..to] : 0 record,
+# DEPTH is only known at the end so it is written over its padded place
+class MifWriter(RecordWriter):
+    extension = ".mif"
+
+    def header(self):
+        return (f"WIDTH={self.word_size};\n" + self.depth_line(0)
+                + "ADDRESS_RADIX=HEX;\nDATA_RADIX=HEX;\nCONTENT BEGIN\n")
+
+    @staticmethod
+    def depth_line(depth):
+        return f"DEPTH={depth:<10};\n"
+
+    def records(self, address, words):
+        lines = []
+        if address > self.end:
+            lines.append(f"\t[{self.end:x}..{address - 1:x}] : 0;\n")
+        digits = self.digits
+        for i, word in enumerate(words, address):
+            lines.append(f"\t{i:x} : {word:0{digits}x};\n")
+        return "".join(lines)
+
+    def footer(self):
+        return "END;\n"
+
+    def close(self):
+        super().close()
+        with open(self.fout.name, "r+b") as f:
+            header = f.read(64)
+            f.seek(header.index(b"DEPTH="))
+            f.write(self.depth_line(max(self.end, 1)).encode("ascii"))
+
+
+# xilinx coefficient file. it has no addresses, so gaps are written as zeros
+# and the words must come in address order
+class CoeWriter(RecordWriter):
+    extension = ".coe"
+
+    def header(self):
+        return ("memory_initialization_radix=16;\n"
+                "memory_initialization_vector=\n")
+
+    def records(self, address, words):
+        if address < self.end:
+            raise ValueError("coe images must be written in address order")
+        zeros = address - self.end
+        text = "0\n" * zeros + self.hex_lines(words)
+        # every word but the last is followed by a comma
+        if self.end:
+            text = "\n" + text
+        return text[:-1].replace("\n", ",\n")
+
+    def footer(self):
+        return ";\n"
+
+
+# output modes written by a RecordWriter, by name
+FORMATS = {"readmemh": ReadmemhWriter, "ihex": IntelHexWriter,
+           "mif": MifWriter, "coe": CoeWriter}
+
+
+# (address, words) runs in address order without overlaps, as a file
+# written with the runs in the same order would hold them: a later word
+# replaces an earlier one. runs already in order are returned as they are
+def merge_runs(runs):
+    runs = [(address, words) for address, words in runs if len(words)]
+    if all(a + len(words) <= b
+           for (a, words), (b, _) in zip(runs, runs[1:])):
+        return runs
+    starts = []
+    merged = []
+    for address, words in runs:
+        end = address + len(words)
+        # the runs the new one overlaps are merged[first:last]
+        first = bisect_right(starts, address)
+        if first and starts[first - 1] + len(merged[first - 1][1]) > address:
+            first -= 1
+        last = bisect_left(starts, end)
+        pieces = [(address, words)]
+        if first < last:
+            start, old = merged[first]
+            if start < address:
+                pieces.insert(0, (start, old[:address - start]))
+            start, old = merged[last - 1]
+            if start + len(old) > end:
+                pieces.append((end, old[end - start:]))
+        merged[first:last] = pieces
+        starts[first:last] = [address for address, _ in pieces]
+    # runs that now touch are joined
+    joined = []
+    for address, words in merged:
+        if joined and joined[-1][0] + len(joined[-1][1]) == address:
+            joined[-1][1].extend(words)
+        else:
+            joined.append((address, array("I", words)))
+    return joined
+
+
+# a writer for any output mode, raw binary and fixed width text lines can
+# be patched, record formats can not
+def open_image(filename, mode="binary", byteorder="big", word_size=32):
+    if mode in FORMATS:
+        return FORMATS[mode](filename, word_size, byteorder)
+    return ImageWriter(filename, mode, byteorder, word_size=word_size)
+
+
+# words kept in memory as one column, with where each run of consecutive
+# addresses starts
+class WordBuffer:
+    words: array
+    starts: list  # (address, index of its first word) of every run
+    next: int  # address that continues the last run
+
+    def __init__(self):
+        self.words = array("I")
+        self.starts = []
+        self.next = None
+
+    # returns the index of the word as the handle to patch it with
+    def write(self, address, word):
+        if address != self.next:
+            self.starts.append((address, len(self.words)))
+        self.next = address + 1
+        self.words.append(word)
+        return len(self.words) - 1
+
+    def write_words(self, address, words):
+        index = len(self.words)
+        if words:
+            if address != self.next:
+                self.starts.append((address, index))
+            self.next = address + len(words)
+            self.words.extend(words)
+        return index
+
+    def patch(self, index, bits):
+        self.words[index] |= bits
+
+    # (address, words) of every run
+    def runs(self):
+        ends = [index for _, index in self.starts[1:]] + [len(self.words)]
+        for (address, start), end in zip(self.starts, ends):
+            yield address, self.words[start:end]
+
+    def lines(self):
+        for address, words in self.runs():
+            yield from enumerate(words, address)
+
+
+# output for when nothing is written
+class NullImage:
+    def write(self, address, word):
+        return address
+
+    def write_words(self, address, words):
+        return address
+
+    def patch(self, address, bits):
+        pass